@@ -1,22 +1,48 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, stream_with_context, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import os
+import threading
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut
-from geopy.distance import geodesic
-from sqlalchemy import or_
-from train.predict import predict
+from sqlalchemy import or_, and_, func, select, update, delete, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from train.model_loader import ModelLoader
+from train.batching import MicroBatcher
+from train.usda_lookup import UsdaLookup
 from dataclasses import dataclass
 import json
 from flask_migrate import Migrate
 import csv # Import the csv module
+from geo import encode_geohash, geohash_cover, distances_km
+from catalog import ProductCatalog, NUTRIENT_KEYS
+from product_search import ProductSearch
+from inventory import InventorySweeper, active_filter
+from recommender import score_products, top_k, search_meal_sets
+import numpy as np
+from itertools import islice
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'  # Change this to a secure secret key
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///food_platform.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///food_platform.db')
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # SQLite 的 busy timeout（秒）：其他連線寫入中時等待鎖釋放，而不是立刻回報 database is locked
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+app.config['DISTANCE_MODE'] = 'haversine'  # 'haversine'（快速）或 'geodesic'（精確）
+app.config['MEAL_SET_POOL_SIZE'] = 200  # 套餐搜尋的候選商品數
+app.config['MEAL_SET_BEAM_WIDTH'] = 64  # 套餐搜尋每層保留的組合數
+app.config['MEAL_SET_TIME_LIMIT'] = 0.05  # 套餐搜尋時間上限（秒）
+app.config['PREDICT_MAX_BATCH_SIZE'] = 16  # 營養預測合併批次的最大請求數
+app.config['PREDICT_MAX_WAIT_MS'] = 5  # 營養預測合併批次的最長等待時間（毫秒）
+app.config['PREDICT_TIMEOUT'] = 60  # 單一營養預測請求等待結果的秒數（含第一次載入模型）
+app.config['NUTRITION_MODEL_WARMUP'] = True  # 啟動時在背景預先載入營養預測模型
+app.config['PRODUCTS_PER_PAGE'] = 24  # 首頁每頁顯示的商品數
+app.config['CATALOG_MAX_AGE'] = 300  # 推薦用商品目錄快照最長沿用秒數，超過時整份重建
+app.config['INVENTORY_SWEEP_INTERVAL'] = 3600  # 封存過期或售完商品的間隔（秒），0 表示不在背景執行
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
@@ -24,6 +50,12 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 import_food_data = 1 # Set to 1 to import food data, 0 to skip
+MIN_SET_SIZE, MAX_SET_SIZE = 2, 5  # 套餐商品數範圍
+MAX_PREDICT_BATCH_SIZE = 256  # /predict_nutrition_batch 單次請求的名稱上限
+MAX_PRODUCTS_PER_PAGE = 100  # 首頁 per_page 參數的上限
+LISTING_BATCH_SIZE = 500  # 商品列表每次查詢資料庫的筆數
+MAX_DISTANCE_CANDIDATES = 2000  # 距離篩選一次取出的候選商品 id 上限，超過時改依 id 逐批掃描
+CART_WRITE_ATTEMPTS = 3  # 購物車寫入遇到資料庫被鎖住時的嘗試次數
 
 # Database Models
 class User(UserMixin, db.Model):
@@ -65,6 +97,16 @@ class Product(db.Model):
     store_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     store = db.relationship('User', backref=db.backref('products', lazy=True))
     cart_count = db.Column(db.Integer, default=0)  # 新增：追蹤購物車數量
+    geohash = db.Column(db.String(12), index=True)  # 空間索引：由經緯度自動計算
+    discounted_price = db.Column(db.Float, nullable=False)  # 折扣後價格：由原價與折扣率自動計算，供價格篩選使用索引
+
+    __table_args__ = (
+        # 常見的篩選組合：價格上限＋到期日、店家＋到期日
+        db.Index('ix_product_discounted_price_expiry_date', 'discounted_price', 'expiry_date'),
+        db.Index('ix_product_store_id_expiry_date', 'store_id', 'expiry_date'),
+        # 只索引仍有庫存的商品：查詢條件需包含 quantity > 0 才會使用
+        db.Index('ix_product_active_expiry_date', 'expiry_date', sqlite_where=db.text('quantity > 0')),
+    )
 
     def to_dict(self):
         return {
@@ -78,13 +120,31 @@ class Product(db.Model):
             'expiry_date': self.expiry_date.strftime('%Y-%m-%d'),
             'original_price': self.original_price,
             'discount_rate': self.discount_rate,
-            'discounted_price': self.original_price * self.discount_rate,
+            'discounted_price': self.discounted_price,
             'nutrition_info': self.nutrition_info,
             'store_id': self.store_id,
             'store_username': self.store.username,
             'cart_count': self.cart_count  # 新增：返回購物車數量
         }
 
+@db.event.listens_for(Product, 'before_insert')
+@db.event.listens_for(Product, 'before_update')
+def update_product_geohash(mapper, connection, product):
+    # 新增或修改商品時同步更新 geohash，確保空間索引與經緯度一致
+    product.geohash = encode_geohash(product.latitude, product.longitude)
+
+@db.event.listens_for(Product, 'before_insert')
+@db.event.listens_for(Product, 'before_update')
+def update_product_discounted_price(mapper, connection, product):
+    # 新增或修改商品時同步更新折扣後價格，讓價格篩選可以直接使用索引
+    product.discounted_price = product.original_price * product.discount_rate
+
+# 推薦演算法使用的商品目錄快照，會隨商品的新增、修改、刪除自動更新
+product_catalog = ProductCatalog(db, Product, max_age=app.config['CATALOG_MAX_AGE'])
+
+# 商品名稱、描述與地址的全文檢索索引（SQLite FTS5，由觸發器與商品表同步）
+product_search = ProductSearch(db, Product)
+
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -95,6 +155,37 @@ class CartItem(db.Model):
     user = db.relationship('User', backref=db.backref('cart_items', lazy=True))
     product = db.relationship('Product', backref=db.backref('cart_items', lazy=True))
 
+    __table_args__ = (
+        # 同一使用者的同一商品只有一列，加入購物車時以 upsert 累加數量
+        db.Index('ix_cart_item_user_id_product_id', 'user_id', 'product_id', unique=True),
+        # 刪除的項目 id 不再重複使用，並行請求拿著已刪除項目的 id 時不會改到別人新加入的項目
+        {'sqlite_autoincrement': True}
+    )
+
+class ArchivedProduct(db.Model):
+    """已過期或售完而移出商品表的商品（冷資料），id 沿用原商品 id"""
+    __tablename__ = 'archived_product'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.String(200))
+    quantity = db.Column(db.Integer, nullable=False)
+    address = db.Column(db.String(200), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    expiry_date = db.Column(db.DateTime, nullable=False)
+    original_price = db.Column(db.Float, nullable=False)
+    discount_rate = db.Column(db.Float, nullable=False)
+    discounted_price = db.Column(db.Float, nullable=False)
+    nutrition_info = db.Column(db.JSON)
+    store_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    cart_count = db.Column(db.Integer, default=0)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    archive_reason = db.Column(db.String(20), nullable=False)  # 'expired' 或 'sold_out'
+
+# 定期把過期或售完的商品移到封存表，商品表只保留在架商品
+inventory_sweeper = InventorySweeper(db, Product, ArchivedProduct, CartItem, on_archived=product_catalog.mark_changed)
+
 def calculate_nutrition_needs(user: User) -> NutritionNeeds:
     age = user.get_age()
     gender = user.gender
@@ -190,72 +281,197 @@ def calculate_nutrition_needs(user: User) -> NutritionNeeds:
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# Routes
-@app.route('/')
-def index():
-    # 獲取搜尋參數
-    search = request.args.get('search', '').strip()
-    max_price = request.args.get('max_price', type=float)
-    distance = request.args.get('distance', type=float)
-    user_lat = request.args.get('user_lat', type=float)
-    user_lon = request.args.get('user_lon', type=float)
-
-    # 基本查詢
-    query = Product.query
-
-    # 關鍵字搜尋（商品名稱或地址）
-    if search:
+def listing_args():
+    """從查詢參數讀取商品列表的篩選條件"""
+    return {
+        'search': request.args.get('search', '').strip(),
+        'max_price': request.args.get('max_price', type=float),
+        'distance': request.args.get('distance', type=float),
+        'user_lat': request.args.get('user_lat', type=float),
+        'user_lon': request.args.get('user_lon', type=float)
+    }
+
+def iter_listing(search='', max_price=None, distance=None, user_lat=None, user_lon=None,
+                 after_id=0, batch_size=LISTING_BATCH_SIZE):
+    """
+    逐批取出符合篩選條件的商品（keyset 分頁）
+
+    排序方式依篩選條件決定，讓查詢沿著索引進行，而不是逐列掃描整個商品表：
+    有關鍵字時依全文檢索的相關性；有距離篩選時先由 geohash 索引一次取出候選商品 id（依 id 排序），
+    再逐批依 id 載入（候選商品超過 MAX_DISTANCE_CANDIDATES 時直接依 id 逐批掃描）；只有價格篩選時依 (折扣後價格, 到期日, id) 排序，與複合索引的順序相同，
+    每批只讀取一批的範圍；其餘依 id 排序。
+    游標一律為上一頁最後一個商品的 id。店家以 joinedload 一起載入，
+    因此不會為每個商品再查一次店家，也不需要一次把所有商品載入記憶體。
+
+    Args:
+        search (str): 關鍵字（商品名稱、描述或地址），以空白分隔多個關鍵字
+        max_price (float): 折扣後價格上限
+        distance (float): 距離上限（公里），需搭配 user_lat/user_lon
+        user_lat (float): 使用者緯度
+        user_lon (float): 使用者經度
+        after_id (int): 從這個 id 之後開始（游標）
+        batch_size (int): 每次查詢的筆數
+
+    Yields:
+        Product: 符合條件的商品，product.distance 為距離（公里）或 None
+    """
+    # 基本查詢：只列出仍有庫存且未過期的商品
+    query = Product.query.options(joinedload(Product.store)).filter(active_filter(Product))
+
+    # 關鍵字搜尋：使用全文檢索索引，SQLite 不支援 FTS5 時退回 LIKE 比對
+    ranked_ids = product_search.ranked_ids(search) if search else None
+    if search and ranked_ids is None:
         query = query.filter(or_(
             Product.name.ilike(f'%{search}%'),
             Product.address.ilike(f'%{search}%')
         ))
 
     # 價格篩選（考慮折扣後的價格）
-    if max_price is not None and max_price > 0:
-        query = query.filter(Product.original_price * Product.discount_rate <= max_price)
+    has_price_filter = max_price is not None and max_price > 0
+    if has_price_filter:
+        query = query.filter(Product.discounted_price <= max_price)
+
+    has_distance_filter = distance is not None and distance > 0 and user_lat is not None and user_lon is not None
+
+    # keyset 分頁的排序欄位
+    order = (Product.id,)
+
+    # 距離篩選：只取 geohash 落在候選格子內的商品（沒有經緯度的商品照舊保留），
+    # 每個格子是 geohash 索引上的一段範圍
+    if has_distance_filter:
+        cells = geohash_cover(user_lat, user_lon, distance)
+        nearby = or_(
+            Product.geohash.is_(None),
+            *[and_(Product.geohash >= cell, Product.geohash < cell + '~') for cell in cells]
+        )
+        query = query.filter(nearby)
+        if ranked_ids is None:
+            # 候選 id 只查一次（只讀 geohash 索引），之後與關鍵字搜尋一樣逐批依 id 載入並套用其餘條件，
+            # 不必每一批都重新比對所有格子。不在 SQL 中 ORDER BY id，否則 SQLite 會改為依 rowid 掃描整個商品表。
+            # 候選商品很多時，範圍內的商品夠密集，依 id 逐批掃描很快就能湊滿一批，不必先取出所有 id
+            candidate_ids = db.session.scalars(
+                select(Product.id).where(nearby).limit(MAX_DISTANCE_CANDIDATES + 1)
+            ).all()
+            if len(candidate_ids) <= MAX_DISTANCE_CANDIDATES:
+                ranked_ids = sorted(candidate_ids)
+    elif has_price_filter:
+        # 只有價格篩選時沿著 (discounted_price, expiry_date) 複合索引分頁，
+        # 符合條件的商品再多也只讀取一頁的範圍
+        order = (Product.discounted_price, Product.expiry_date, Product.id)
+
+    def with_distance(products):
+        # 如果有設定距離篩選且有用戶位置，對這一批候選商品一次計算距離並篩選
+        if has_distance_filter:
+            distances = distances_km(
+                user_lat, user_lon,
+                [product.latitude for product in products],
+                [product.longitude for product in products],
+                mode=app.config['DISTANCE_MODE']
+            )
+            for product, dist in zip(products, distances):
+                if np.isnan(dist):
+                    # 沒有完整經緯度資訊的商品不做距離篩選
+                    product.distance = None
+                    yield product
+                elif dist <= distance:
+                    # 只保留在指定距離範圍內的商品
+                    product.distance = round(float(dist), 2)
+                    yield product
+        else:
+            # 如果沒有進行距離篩選，確保所有商品的距離屬性都被設置為 None
+            for product in products:
+                product.distance = None
+                yield product
+
+    if ranked_ids is not None:
+        # 依相關性（或 id）順序逐批載入；游標商品已不在結果中（例如被刪除）時視為沒有下一頁
+        start = 0
+        if after_id:
+            positions = {product_id: i for i, product_id in enumerate(ranked_ids)}
+            if after_id not in positions:
+                return
+            start = positions[after_id] + 1
+        for i in range(start, len(ranked_ids), batch_size):
+            batch = ranked_ids[i:i + batch_size]
+            loaded = {product.id: product for product in query.filter(Product.id.in_(batch)).all()}
+            yield from with_distance([loaded[product_id] for product_id in batch if product_id in loaded])
+        return
+
+    # 游標商品在排序欄位上的值；商品已不存在（例如被封存）時視為沒有下一頁
+    cursor = None
+    if after_id:
+        cursor = db.session.execute(select(*order).where(Product.id == after_id)).first()
+        if cursor is None:
+            return
+
+    while True:
+        batch_query = query if cursor is None else query.filter(tuple_(*order) > tuple_(*cursor))
+        products = batch_query.order_by(*order).limit(batch_size).all()
+        if not products:
+            return
+        cursor = tuple(getattr(products[-1], column.key) for column in order)
+
+        yield from with_distance(products)
+
+        if len(products) < batch_size:
+            return
+
+def listing_page_size():
+    """每頁商品數：查詢參數 per_page，預設為 PRODUCTS_PER_PAGE，上限 MAX_PRODUCTS_PER_PAGE"""
+    per_page = request.args.get('per_page', app.config['PRODUCTS_PER_PAGE'], type=int)
+    return max(1, min(per_page, MAX_PRODUCTS_PER_PAGE))
 
-    # 執行查詢
-    products = query.all()
+# Routes
+@app.route('/')
+def index():
+    # 獲取搜尋參數
+    filters = listing_args()
+    after_id = request.args.get('after', 0, type=int)
+    per_page = listing_page_size()
 
-    # 如果有設定距離篩選且有用戶位置，進行距離篩選
-    if distance is not None and distance > 0 and user_lat is not None and user_lon is not None:
-        filtered_products = []
-        user_location = (user_lat, user_lon)
-        
-        for product in products:
-            # 初始化距離為 None
-            product.distance = None
-            
-            # 只有當商品有完整的經緯度資訊時才計算距離
-            if product.latitude is not None and product.longitude is not None:
-                try:
-                    product_location = (product.latitude, product.longitude)
-                    # 計算距離（公里）
-                    dist = geodesic(user_location, product_location).kilometers
-                    product.distance = round(dist, 2)
-                    
-                    # 只添加在指定距離範圍內的商品
-                    if dist <= distance:
-                        filtered_products.append(product)
-                except ValueError:
-                    # 如果計算距離時發生錯誤，將商品距離設為 None
-                    product.distance = None
-            else:
-                filtered_products.append(product)
-            
-        products = filtered_products
-    else:
-        # 如果沒有進行距離篩選，確保所有商品的距離屬性都被設置為 None
-        for product in products:
-            product.distance = None
+    # 多取一筆，用來判斷是否還有下一頁
+    products = list(islice(iter_listing(after_id=after_id, batch_size=per_page + 1, **filters), per_page + 1))
+    next_cursor = None
+    if len(products) > per_page:
+        products = products[:per_page]
+        next_cursor = products[-1].id
 
     return render_template('index.html', 
                          products=products,
-                         search=search,
-                         max_price=max_price,
-                         distance=distance,
-                         user_lat=user_lat,
-                         user_lon=user_lon)
+                         next_cursor=next_cursor,
+                         after=after_id,
+                         per_page=per_page,
+                         **filters)
+
+@app.route('/api/products')
+def list_products_json():
+    """
+    以串流方式回傳商品列表（JSON）
+
+    篩選參數與首頁相同；指定 limit 時最多回傳 limit 筆，並在 next_cursor 提供下一頁的 after 值，
+    未指定時回傳所有符合條件的商品。回應邊查詢邊輸出，不會先在記憶體中建立整份清單。
+    """
+    filters = listing_args()
+    after_id = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', type=int)
+
+    def generate():
+        yield '{"products": ['
+        count = 0
+        last_id = None
+        next_cursor = None
+        for product in iter_listing(after_id=after_id, **filters):
+            if limit is not None and count >= limit:
+                next_cursor = last_id
+                break
+            item = product.to_dict()
+            item['distance'] = product.distance
+            yield (',' if count else '') + json.dumps(item, ensure_ascii=False)
+            count += 1
+            last_id = product.id
+        yield f'], "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -392,6 +608,32 @@ def check_coordinates():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+# 營養預測模型在第一次使用（或背景預熱）時才載入
+nutrition_model = ModelLoader()
+
+# 將同時到達的 /predict_nutrition 請求合併成批次送進模型
+nutrition_batcher = MicroBatcher(
+    nutrition_model.predict_batch,
+    max_batch_size=app.config['PREDICT_MAX_BATCH_SIZE'],
+    max_wait_ms=app.config['PREDICT_MAX_WAIT_MS'],
+    timeout=app.config['PREDICT_TIMEOUT']
+)
+
+# 先查 USDA 資料表，查不到的名稱才交給模型預測
+usda_lookup = UsdaLookup()
+
+def format_nutrition(nutrition_values):
+    # 轉換預測結果格式以符合前端期望，並四捨五入到小數點後兩位
+    return {
+        'energy': round(nutrition_values['Energy']['value'], 2),
+        'protein': round(nutrition_values['Protein']['value'], 2),
+        'fat': round(nutrition_values['Fat']['value'], 2),
+        'carbohydrate': round(nutrition_values['Carbohydrate']['value'], 2),
+        'fiber': round(nutrition_values['Fiber']['value'], 2),
+        'sugars': round(nutrition_values['Sugars']['value'], 2),
+        'sodium': round(nutrition_values['Sodium']['value'], 2)
+    }
+
 @app.route('/predict_nutrition', methods=['POST'])
 def predict_nutrition():
     try:
@@ -401,28 +643,71 @@ def predict_nutrition():
         if not food_name:
             return jsonify({'success': False, 'error': '請提供食物名稱'})
 
-        # 使用 predict.py 中的預測函數
-        nutrition_values = predict(food_name)
-        
-        # 轉換預測結果格式以符合前端期望，並四捨五入到小數點後兩位
-        formatted_values = {
-            'energy': round(nutrition_values['Energy']['value'], 2),
-            'protein': round(nutrition_values['Protein']['value'], 2),
-            'fat': round(nutrition_values['Fat']['value'], 2),
-            'carbohydrate': round(nutrition_values['Carbohydrate']['value'], 2),
-            'fiber': round(nutrition_values['Fiber']['value'], 2),
-            'sugars': round(nutrition_values['Sugars']['value'], 2),
-            'sodium': round(nutrition_values['Sodium']['value'], 2)
-        }
+        # 資料表中有這個食物時直接使用實測值
+        match = usda_lookup.lookup(food_name)
+        if match:
+            return jsonify({
+                'success': True,
+                'nutrition': format_nutrition(match['nutrition']),
+                'source': 'usda',
+                'matched_name': match['matched_name'],
+                'match': match['match']
+            })
+
+        # 透過批次佇列使用 predict.py 中的預測函數
+        nutrition_values = nutrition_batcher.predict(food_name)
+
+        return jsonify({
+            'success': True,
+            'nutrition': format_nutrition(nutrition_values),
+            'source': 'model'
+        })
+
+    except TimeoutError:
+        return jsonify({'success': False, 'error': '營養預測逾時，請稍後再試'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/predict_nutrition_batch', methods=['POST'])
+def predict_nutrition_batch():
+    try:
+        data = request.get_json()
+        food_names = data.get('food_names')
+
+        if not food_names or not isinstance(food_names, list) or not all(isinstance(name, str) and name for name in food_names):
+            return jsonify({'success': False, 'error': '請提供食物名稱清單'})
+
+        if len(food_names) > MAX_PREDICT_BATCH_SIZE:
+            return jsonify({'success': False, 'error': f'一次最多預測 {MAX_PREDICT_BATCH_SIZE} 個食物'})
+
+        # 先查資料表，其餘名稱一次前向傳播預測
+        matches = [usda_lookup.lookup(name) for name in food_names]
+        unknown = [name for name, match in zip(food_names, matches) if match is None]
+        predictions = iter(nutrition_model.predict_batch(unknown) if unknown else [])
+        nutrition_values = [match['nutrition'] if match else next(predictions) for match in matches]
 
         return jsonify({
             'success': True,
-            'nutrition': formatted_values
+            'nutrition': [format_nutrition(values) for values in nutrition_values],
+            'sources': ['usda' if match else 'model' for match in matches],
+            'matched_names': [match['matched_name'] if match else None for match in matches]
         })
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/predict_nutrition/metrics')
+def predict_nutrition_metrics():
+    metrics = nutrition_batcher.metrics()
+    metrics['cache'] = nutrition_model.cache_stats()
+    return jsonify(metrics)
+
+@app.route('/predict_nutrition/status')
+def predict_nutrition_status():
+    # 模型載入狀態（可作為 readiness 檢查，尚未載入完成時回傳 503）
+    status = nutrition_model.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/add_product', methods=['GET', 'POST'])
 @login_required
 def add_product():
@@ -521,143 +806,103 @@ def get_recommendations():
     user_lat = data.get('latitude')
     user_lon = data.get('longitude')
     max_price = data.get('max_price')
-
-    # Get all available products
-    products = Product.query.all()
-    if not products:
+    set_size = data.get('set_size', 3)
+    budget = data.get('budget')
+
+    if not isinstance(set_size, int) or not MIN_SET_SIZE <= set_size <= MAX_SET_SIZE:
+        return jsonify({'error': f'set_size must be between {MIN_SET_SIZE} and {MAX_SET_SIZE}'}), 400
+    # not budget >= 0 also rejects NaN
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or not budget >= 0):
+        return jsonify({'error': 'budget must be a non-negative number'}), 400
+
+    # Get all available products from the columnar catalog snapshot
+    catalog = product_catalog.snapshot()
+    if not len(catalog):
         return jsonify({'error': 'No products available'}), 404
 
     # Calculate user's nutritional needs
     nutrition_needs = calculate_nutrition_needs(current_user)
-
-    # Score and rank individual products
-    scored_products = []
-    for product in products:
-        if not product.nutrition_info:
-            continue
-
-        # Calculate distance if location is available, otherwise set to 0
-        if all([user_lat, user_lon, product.latitude, product.longitude]):
-            distance = geodesic(
-                (user_lat, user_lon),
-                (product.latitude, product.longitude)
-            ).kilometers
-        else:
-            distance = 0
-
-        # Skip products beyond max price if specified
-        discounted_price = product.original_price * product.discount_rate
-        if max_price and discounted_price > max_price:
-            continue
-
-        # Calculate nutrition match score
-        nutrition_score = 1 - (
-            abs(float(product.nutrition_info.get('energy', 0)) / nutrition_needs.calories - 0.33) +
-            abs(float(product.nutrition_info.get('protein', 0)) / nutrition_needs.protein - 0.33) +
-            abs(float(product.nutrition_info.get('fat', 0)) / nutrition_needs.fat - 0.33) +
-            abs(float(product.nutrition_info.get('carbohydrate', 0)) / nutrition_needs.carbs - 0.33) +
-            abs(float(product.nutrition_info.get('fiber', 0)) / nutrition_needs.fiber - 0.33) +
-            abs(float(product.nutrition_info.get('sodium', 0)) / nutrition_needs.sodium - 0.33)
-        ) / 6  # 將差異值轉換為分數（差異越小，分數越高）
-
-        # Calculate price score (lower price = higher score)
-        max_price_score = max_price if max_price else max(p.original_price * p.discount_rate for p in products)
-        price_score = 1 - (discounted_price / max_price_score)
-
-        # Combined score (weighted average of nutrition and price, distance weight is 0 if no location)
-        if distance == 0:
-            total_score = (
-                0.7 * nutrition_score +  # 增加營養評分的權重
-                0.3 * price_score  # 增加價格權重
-            )
-        else:
-            total_score = (
-                0.5 * nutrition_score +
-                0.25 * (1 / (1 + distance)) +
-                0.25 * price_score
+    needs = (
+        nutrition_needs.calories, nutrition_needs.protein, nutrition_needs.fat,
+        nutrition_needs.carbs, nutrition_needs.fiber, nutrition_needs.sodium
+    )
+
+    # Calculate all distances in one pass if location is available, otherwise set to 0
+    distances = np.zeros(len(catalog))
+    if user_lat and user_lon:
+        has_location = (
+            ~np.isnan(catalog.latitude) & ~np.isnan(catalog.longitude) &
+            (catalog.latitude != 0) & (catalog.longitude != 0)
+        )
+        if has_location.any():
+            distances[has_location] = distances_km(
+                user_lat, user_lon,
+                catalog.latitude[has_location],
+                catalog.longitude[has_location],
+                mode=app.config['DISTANCE_MODE']
             )
 
-        scored_products.append({
-            'product': product.to_dict(),
-            'distance': round(distance, 2),
-            'score': total_score
-        })
-
-    # Sort by score and get top 3 individual products
-    scored_products.sort(key=lambda x: x['score'], reverse=True)
-    individual_recommendations = scored_products[:3]
-
-    # Generate meal set recommendations
-    meal_sets = []
-    # Get top 10 products to create sets from
-    top_products = scored_products[:10]
-    
-    from itertools import combinations
-    possible_sets = list(combinations(top_products, 3))
-    
-    for product_set in possible_sets:
-        # Calculate total nutrition for the set
-        total_nutrition = {
-            'energy': 0,
-            'protein': 0,
-            'fat': 0,
-            'carbohydrate': 0,
-            'fiber': 0,
-            'sodium': 0
+    discounted_prices = catalog.discounted_price
+
+    # Products without nutrition info or beyond max price (if specified) are skipped
+    candidates = catalog.has_nutrition.copy()
+    if max_price:
+        candidates &= discounted_prices <= max_price
+
+    # Score every product in one batched pass
+    scores = score_products(catalog.nutrients, discounted_prices, distances, needs, max_price)
+    candidate_scores = np.where(candidates, scores, -np.inf)
+
+    # Get top 3 individual products
+    top_indices = top_k(candidate_scores, 3)
+
+    # Search meal sets among the best-scoring products within a fixed latency budget
+    pool = top_k(candidate_scores, app.config['MEAL_SET_POOL_SIZE'])
+    max_set_price = float(discounted_prices[candidates].max()) * set_size if candidates.any() else 0
+    found_sets = search_meal_sets(
+        catalog.nutrients, discounted_prices, distances, needs, pool,
+        set_size=set_size,
+        price_cap=max_price * set_size if max_price else max_set_price,
+        budget=budget,
+        beam_width=app.config['MEAL_SET_BEAM_WIDTH'],
+        num_sets=2,
+        time_limit=app.config['MEAL_SET_TIME_LIMIT']
+    )
+
+    # Load the ORM rows (with their store) only for the products that are returned.
+    # Products deleted or archived since the snapshot was taken are left out of product_dicts.
+    returned_ids = {int(catalog.ids[i]) for i in top_indices}
+    for members, _ in found_sets:
+        returned_ids.update(int(catalog.ids[i]) for i in members)
+    product_dicts = {
+        product.id: product.to_dict()
+        for product in Product.query.options(joinedload(Product.store))
+        .filter(Product.id.in_(returned_ids), active_filter(Product))
+    }
+
+    individual_recommendations = [
+        {
+            'product': product_dicts[int(catalog.ids[i])],
+            'distance': round(float(distances[i]), 2),
+            'score': float(scores[i])
         }
-        
-        total_price = 0
-        avg_distance = 0
-        
-        for item in product_set:
-            product = item['product']
-            nutrition = product['nutrition_info']
-            
-            for key in total_nutrition:
-                total_nutrition[key] += float(nutrition.get(key, 0))
-            
-            total_price += product['original_price'] * product['discount_rate']
-            avg_distance += item['distance']
-        
-        avg_distance /= len(product_set)
-        
-        # Calculate nutrition balance score for the set
-        nutrition_balance = 1 - (
-            abs(total_nutrition['energy'] / nutrition_needs.calories - 1.0) +
-            abs(total_nutrition['protein'] / nutrition_needs.protein - 1.0) +
-            abs(total_nutrition['fat'] / nutrition_needs.fat - 1.0) +
-            abs(total_nutrition['carbohydrate'] / nutrition_needs.carbs - 1.0) +
-            abs(total_nutrition['fiber'] / nutrition_needs.fiber - 1.0) +
-            abs(total_nutrition['sodium'] / nutrition_needs.sodium - 1.0)
-        ) / 6  # 將差異值轉換為分數（差異越小，分數越高）
-        
-        # Calculate price score
-        price_score = 1 - (total_price / (max_price * 3 if max_price else max(p['product']['original_price'] * p['product']['discount_rate'] * 3 for p in scored_products)))
-        
-        # Calculate set score (adjust weights if no location data)
-        if avg_distance == 0:
-            set_score = (
-                0.7 * nutrition_balance +  # 增加營養平衡的權重
-                0.3 * price_score  # 增加價格權重
-            )
-        else:
-            set_score = (
-                0.5 * nutrition_balance +
-                0.25 * (1 / (1 + avg_distance)) +
-                0.25 * price_score
-            )
-        
-        meal_sets.append({
-            'products': [p['product'] for p in product_set],
-            'total_nutrition': total_nutrition,
-            'total_price': round(total_price, 2),
-            'avg_distance': round(avg_distance, 2),
+        for i in top_indices
+        if int(catalog.ids[i]) in product_dicts
+    ]
+
+    set_recommendations = []
+    for members, set_score in found_sets:
+        members = list(members)
+        # Skip sets with a member that is no longer available
+        if not all(int(catalog.ids[i]) in product_dicts for i in members):
+            continue
+        set_recommendations.append({
+            'products': [product_dicts[int(catalog.ids[i])] for i in members],
+            'total_nutrition': dict(zip(NUTRIENT_KEYS, catalog.nutrients[members].sum(axis=0).tolist())),
+            'total_price': round(float(discounted_prices[members].sum()), 2),
+            'avg_distance': round(float(distances[members].mean()), 2),
             'score': set_score
         })
-    
-    # Sort meal sets by score and get top 2
-    meal_sets.sort(key=lambda x: x['score'], reverse=True)
-    set_recommendations = meal_sets[:2]
 
     return jsonify({
         'individual_recommendations': individual_recommendations,
@@ -713,11 +958,50 @@ def view_cart():
         return redirect(url_for('index'))
     
     cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total_price = sum(item.product.original_price * item.product.discount_rate * item.quantity 
-                     for item in cart_items)
+    total_price = sum(item.product.discounted_price * item.quantity for item in cart_items)
     
     return render_template('cart.html', cart_items=cart_items, total_price=total_price)
 
+def adjust_cart_count(product_id, change):
+    """
+    以單一 UPDATE 原子地調整商品的購物車計數，不先把數值讀進 Python，並行請求不會互相覆蓋
+
+    Args:
+        product_id (int): 商品 ID
+        change (int): 調整量
+
+    Returns:
+        int: 調整後的購物車計數，商品不存在時為 None
+    """
+    return db.session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(cart_count=func.coalesce(Product.cart_count, 0) + change)
+        .returning(Product.cart_count)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+
+def commit_cart_write(write):
+    """
+    執行購物車的寫入並提交；SQLite 在 busy timeout 內仍等不到鎖（database is locked）時，
+    回滾後重新執行整個寫入，最多 CART_WRITE_ATTEMPTS 次
+
+    Args:
+        write (callable): 執行寫入的函式，不需自行提交
+
+    Returns:
+        write 的回傳值
+    """
+    for attempt in range(CART_WRITE_ATTEMPTS):
+        try:
+            result = write()
+            db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if 'locked' not in str(e.orig) or attempt == CART_WRITE_ATTEMPTS - 1:
+                raise
+
 @app.route('/update_cart/<int:item_id>', methods=['POST'])
 @login_required
 def update_cart(item_id):
@@ -726,22 +1010,36 @@ def update_cart(item_id):
     
     data = request.get_json()
     change = data.get('change', 0)
+    if not isinstance(change, int):
+        return jsonify({'success': False, 'message': '無效的數量變更'}), 400
     
-    cart_item = CartItem.query.get_or_404(item_id)
-    if cart_item.user_id != current_user.id:
-        return jsonify({'success': False, 'message': '無權限修改此購物車項目'}), 403
-    
-    new_quantity = cart_item.quantity + change
-    if new_quantity < 1:
-        return jsonify({'success': False, 'message': '商品數量不能小於1'}), 400
-    
-    cart_item.quantity = new_quantity
+    def write():
+        # 以單一 UPDATE 調整數量：條件同時確認擁有者與調整後數量至少為 1
+        product_id = db.session.execute(
+            update(CartItem)
+            .where(CartItem.id == item_id, CartItem.user_id == current_user.id, CartItem.quantity + change >= 1)
+            .values(quantity=CartItem.quantity + change)
+            .returning(CartItem.product_id)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+        if product_id is not None:
+            adjust_cart_count(product_id, change)  # 更新商品的購物車計數
+        return product_id
+
     try:
-        db.session.commit()
-        return jsonify({'success': True})
-    except:
+        product_id = commit_cart_write(write)
+    except Exception:
         db.session.rollback()
         return jsonify({'success': False, 'message': '更新失敗'}), 500
+    
+    if product_id is None:
+        # 沒有更新到任何項目時才查詢原因
+        cart_item = CartItem.query.get_or_404(item_id)
+        if cart_item.user_id != current_user.id:
+            return jsonify({'success': False, 'message': '無權限修改此購物車項目'}), 403
+        return jsonify({'success': False, 'message': '商品數量不能小於1'}), 400
+    
+    return jsonify({'success': True})
 
 @app.route('/remove_from_cart/<int:item_id>', methods=['POST'])
 @login_required
@@ -749,20 +1047,30 @@ def remove_from_cart(item_id):
     if current_user.is_store:
         return jsonify({'success': False, 'message': '店家帳號無法修改購物車'}), 403
     
-    cart_item = CartItem.query.get_or_404(item_id)
-    if cart_item.user_id != current_user.id:
-        return jsonify({'success': False, 'message': '無權限修改此購物車項目'}), 403
-    
-    product = cart_item.product
-    product.cart_count -= cart_item.quantity  # 更新商品的購物車計數
-    
-    db.session.delete(cart_item)
+    def write():
+        # 刪除並取回項目的商品與數量；同一項目被重複刪除時只有一次會成功
+        removed = db.session.execute(
+            delete(CartItem)
+            .where(CartItem.id == item_id, CartItem.user_id == current_user.id)
+            .returning(CartItem.product_id, CartItem.quantity)
+            .execution_options(synchronize_session=False)
+        ).one_or_none()
+        if removed is not None:
+            adjust_cart_count(removed.product_id, -removed.quantity)  # 更新商品的購物車計數
+        return removed
+
     try:
-        db.session.commit()
-        return jsonify({'success': True})
-    except:
+        removed = commit_cart_write(write)
+    except Exception:
         db.session.rollback()
         return jsonify({'success': False, 'message': '刪除失敗'}), 500
+    
+    if removed is None:
+        # 沒有刪除到任何項目時才查詢原因
+        CartItem.query.get_or_404(item_id)
+        return jsonify({'success': False, 'message': '無權限修改此購物車項目'}), 403
+    
+    return jsonify({'success': True})
 
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 @login_required
@@ -770,41 +1078,84 @@ def add_to_cart(product_id):
     if current_user.is_store:
         return jsonify({'success': False, 'message': '店家帳號無法加入購物車'}), 403
 
-    product = Product.query.get_or_404(product_id)
-    
-    # Check if product is already in cart
-    cart_item = CartItem.query.filter_by(
-        user_id=current_user.id,
-        product_id=product_id
-    ).first()
-    
-    if cart_item:
-        cart_item.quantity += 1
-    else:
-        cart_item = CartItem(
-            user_id=current_user.id,
-            product_id=product_id
+    def write():
+        # 先更新購物車計數並取回新的計數，同時確認商品存在（不需另外查詢商品）
+        product_cart_count = adjust_cart_count(product_id, 1)
+        if product_cart_count is None:
+            return None, None, None
+        # 尚未加入時新增項目，已在購物車中則數量加 1（依 user_id + product_id 唯一索引 upsert）
+        quantity = db.session.execute(
+            sqlite_insert(CartItem)
+            .values(user_id=current_user.id, product_id=product_id, quantity=1, added_at=datetime.utcnow())
+            .on_conflict_do_update(
+                index_elements=['user_id', 'product_id'],
+                set_={'quantity': CartItem.quantity + 1}
+            )
+            .returning(CartItem.quantity)
+        ).scalar_one()
+        # 使用者購物車中的項目數（在同一交易中計算，不載入整個購物車）
+        item_count = db.session.scalar(
+            select(func.count()).select_from(CartItem).where(CartItem.user_id == current_user.id)
         )
-        db.session.add(cart_item)
-    
-    # Initialize cart_count if it's None
-    if product.cart_count is None:
-        product.cart_count = 0
-    
-    # Update cart count
-    product.cart_count += 1
-    
+        return product_cart_count, quantity, item_count
+
     try:
-        db.session.commit()
-        return jsonify({
-            'success': True,
-            'message': '已加入購物車',
-            'cart_count': len(current_user.cart_items)
-        })
+        product_cart_count, quantity, item_count = commit_cart_write(write)
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': '加入購物車失敗'}), 500
 
+    if product_cart_count is None:
+        abort(404)
+
+    # cart_count 為使用者購物車中的項目數；product_cart_count 為商品的購物車計數（同 Product.to_dict），
+    # quantity 為此項目在購物車中的數量
+    return jsonify({
+        'success': True,
+        'message': '已加入購物車',
+        'cart_count': item_count,
+        'product_cart_count': product_cart_count,
+        'quantity': quantity
+    })
+
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background_tasks():
+    """
+    在目前的程序啟動背景工作：預先載入營養預測模型、定期封存過期或售完的商品
+
+    每個程序只會啟動一次。由第一個請求觸發，因此 python app.py、flask run 或 WSGI 伺服器的
+    每個 worker 都會在實際處理請求的程序中啟動（debug 模式的 reloader 監看程序不處理請求，不會啟動）。
+    """
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+
+    if app.config['NUTRITION_MODEL_WARMUP']:
+        nutrition_model.warm_up()
+    if app.config['INVENTORY_SWEEP_INTERVAL']:
+        inventory_sweeper.start(app, app.config['INVENTORY_SWEEP_INTERVAL'])
+
+@app.before_request
+def ensure_background_tasks():
+    start_background_tasks()
+
+@app.cli.command('archive-products')
+def archive_products():
+    """
+    封存所有過期或售完的商品（flask --app app archive-products）
+
+    不依賴背景執行緒，可由排程執行，例如 INVENTORY_SWEEP_INTERVAL 設為 0 時以 cron 每小時執行：
+        0 * * * * cd /path/to/project && flask --app app archive-products
+    """
+    counts = inventory_sweeper.sweep()
+    print(f"已封存 {counts['expired']} 筆過期商品、{counts['sold_out']} 筆售完商品")
+
 if __name__ == '__main__':
     with app.app_context():
         # Create tables if they don't exist
@@ -834,11 +1185,17 @@ if __name__ == '__main__':
                 food_data = read_food_data('.csv')
                 if (food_data is not None) and import_food_data:
                     save_to_database(food_data)
+                    # 匯入以 Core insert 寫入，不會觸發 ORM 事件，需重建商品目錄快照
+                    product_catalog.invalidate()
                     print("Food data imported successfully!")
                 
             except Exception as e:
                 db.session.rollback()
                 print(f"Error during setup: {e}")
+    
+    # 啟動時就開始背景工作，不等第一個請求（debug 模式下只在處理請求的 reloader 子程序啟動）
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
             
     app.run(host='0.0.0.0', port=8787, debug=True) 
 
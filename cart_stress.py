@@ -0,0 +1,181 @@
+"""
+購物車並行壓力測試：多個執行緒同時加入、修改、刪除購物車項目，檢查 cart_count 是否遺失更新
+
+使用暫存的 SQLite 資料庫（透過 DATABASE_URL），不會動到 instance/food_platform.db。
+第一階段所有執行緒只對少數熱門商品加入購物車，每個商品的 cart_count 必須等於成功的請求數；
+第二階段混合加入、修改數量與刪除，每個商品的 cart_count 必須等於購物車中該商品的數量總和，
+且同一使用者的同一商品只有一個購物車項目。
+
+用法（在專案根目錄執行）：
+    python cart_stress.py
+    python cart_stress.py --threads 16 --requests 200 --users 4 --products 3
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+
+def run_workers(app, usernames, password, num_threads, worker):
+    """以 num_threads 個執行緒執行 worker(client, thread_index)，每個執行緒各自登入"""
+    barrier = threading.Barrier(num_threads)
+    errors = []
+
+    def run(index):
+        client = app.test_client()
+        client.post('/login', data={'username': usernames[index % len(usernames)], 'password': password})
+        barrier.wait()  # 所有執行緒登入後同時開始，提高競爭
+        try:
+            worker(client, index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(num_threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent cart update stress test')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='requests per thread in each phase')
+    parser.add_argument('--users', type=int, default=4, help='customers shared by the threads')
+    parser.add_argument('--products', type=int, default=3, help='hot products every thread targets')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # 必須在匯入 app 之前設定，讓 app 使用暫存資料庫
+    db_path = os.path.join(tempfile.mkdtemp(prefix='cart_stress_'), 'cart_stress.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    from sqlalchemy import func, select
+    from werkzeug.security import generate_password_hash
+    from app import app, db, User, Product, CartItem
+
+    # 只測試購物車，不啟動模型預先載入與背景封存
+    app.config['NUTRITION_MODEL_WARMUP'] = False
+    app.config['INVENTORY_SWEEP_INTERVAL'] = 0
+
+    password = 'stress'
+    usernames = [f'stress_user_{i}' for i in range(args.users)]
+    with app.app_context():
+        db.create_all()
+        store = User(username='stress_store', email='stress_store@example.com', is_store=True)
+        db.session.add(store)
+        password_hash = generate_password_hash(password)
+        for name in usernames:
+            db.session.add(User(username=name, email=f'{name}@example.com', password_hash=password_hash))
+        db.session.flush()
+        products = [
+            Product(
+                name=f'Stress product {i}', quantity=100, address='none',
+                expiry_date=datetime.now() + timedelta(days=30),
+                original_price=100, discount_rate=0.5, store_id=store.id
+            )
+            for i in range(args.products)
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        product_ids = [product.id for product in products]
+
+    lock = threading.Lock()
+    failures = Counter()
+
+    # 第一階段：只加入購物車
+    added = Counter()
+
+    def add_only(client, index):
+        rng = random.Random(args.seed * 1000 + index)
+        for _ in range(args.requests):
+            product_id = rng.choice(product_ids)
+            response = client.post(f'/add_to_cart/{product_id}')
+            with lock:
+                if response.status_code == 200 and response.get_json()['success']:
+                    added[product_id] += 1
+                else:
+                    failures['add'] += 1
+
+    elapsed = run_workers(app, usernames, password, args.threads, add_only)
+    total = args.threads * args.requests
+    print(f"phase 1: {total} add_to_cart requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+
+    ok = True
+    with app.app_context():
+        counts = dict(db.session.execute(select(Product.id, Product.cart_count)).all())
+        for product_id in product_ids:
+            lost = added[product_id] - counts[product_id]
+            print(f"  product {product_id}: {added[product_id]} successful adds, cart_count {counts[product_id]}, lost {lost}")
+            ok &= lost == 0
+
+    # 第二階段：混合加入、修改數量與刪除
+    def mixed(client, index):
+        rng = random.Random(args.seed * 1000 + args.threads + index)
+        username = usernames[index % len(usernames)]
+        for _ in range(args.requests):
+            action = rng.random()
+            if action < 0.5:
+                response = client.post(f'/add_to_cart/{rng.choice(product_ids)}')
+                kind = 'add'
+            else:
+                with app.app_context():
+                    item_ids = db.session.scalars(
+                        select(CartItem.id).join(User).where(User.username == username)
+                    ).all()
+                if not item_ids:
+                    continue
+                item_id = rng.choice(item_ids)
+                if action < 0.9:
+                    response = client.post(f'/update_cart/{item_id}', json={'change': rng.choice([-1, 1, 2])})
+                    kind = 'update'
+                else:
+                    response = client.post(f'/remove_from_cart/{item_id}')
+                    kind = 'remove'
+            # 數量不能小於 1、項目已被其他執行緒刪除屬於預期的拒絕，其餘視為失敗
+            if response.status_code not in (200, 400, 404):
+                with lock:
+                    failures[kind] += 1
+
+    elapsed = run_workers(app, usernames, password, args.threads, mixed)
+    print(f"phase 2: {total} mixed cart requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+
+    with app.app_context():
+        in_carts = dict(db.session.execute(
+            select(CartItem.product_id, func.sum(CartItem.quantity)).group_by(CartItem.product_id)
+        ).all())
+        counts = dict(db.session.execute(select(Product.id, Product.cart_count)).all())
+        for product_id in product_ids:
+            expected = in_carts.get(product_id, 0)
+            print(f"  product {product_id}: quantity in carts {expected}, cart_count {counts[product_id]}, "
+                  f"drift {expected - counts[product_id]}")
+            ok &= expected == counts[product_id]
+
+        duplicates = db.session.execute(
+            select(func.count()).select_from(
+                select(CartItem.user_id, CartItem.product_id)
+                .group_by(CartItem.user_id, CartItem.product_id)
+                .having(func.count() > 1)
+                .subquery()
+            )
+        ).scalar()
+        print(f"duplicate (user, product) cart items: {duplicates}")
+        ok &= duplicates == 0
+
+    print(f"failed requests: {dict(failures) or 0}")
+    ok &= not failures
+    print('OK: no lost updates' if ok else 'FAILED: cart counters are inconsistent')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, object_session
+
+from inventory import active_filter, expiry_cutoff
+
+# 推薦演算法使用的營養素順序（與 NutritionNeeds 的欄位一一對應）
+NUTRIENT_KEYS = ('energy', 'protein', 'fat', 'carbohydrate', 'fiber', 'sodium')
+
+# 待更新的商品數超過快照大小的這個比例時，直接整份重建
+_REBUILD_RATIO = 0.5
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """商品目錄的欄位式快照，每個欄位都是依商品 id 排序的 NumPy 陣列"""
+    ids: np.ndarray               # int64
+    discounted_price: np.ndarray  # float64，折扣後價格
+    latitude: np.ndarray          # float64，缺漏值為 NaN
+    longitude: np.ndarray         # float64，缺漏值為 NaN
+    expiry_date: np.ndarray       # datetime64[s]
+    nutrients: np.ndarray         # (n, 6) float64，欄位順序同 NUTRIENT_KEYS
+    has_nutrition: np.ndarray     # bool，商品是否有營養資訊
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """由 (id, discounted_price, latitude, longitude, expiry_date, nutrition_info) 列建立快照"""
+        nutrients = np.zeros((len(rows), len(NUTRIENT_KEYS)))
+        has_nutrition = np.zeros(len(rows), dtype=bool)
+        for i, row in enumerate(rows):
+            nutrition_info = row[5]
+            if nutrition_info:
+                has_nutrition[i] = True
+                nutrients[i] = [float(nutrition_info.get(key) or 0) for key in NUTRIENT_KEYS]
+
+        return cls(
+            ids=np.array([row[0] for row in rows], dtype=np.int64),
+            discounted_price=np.array([row[1] for row in rows], dtype=np.float64),
+            latitude=np.array([row[2] for row in rows], dtype=np.float64),
+            longitude=np.array([row[3] for row in rows], dtype=np.float64),
+            expiry_date=np.array([row[4] for row in rows], dtype='datetime64[s]'),
+            nutrients=nutrients,
+            has_nutrition=has_nutrition
+        )
+
+    def take(self, indices):
+        """回傳只包含指定位置的新快照"""
+        return CatalogSnapshot(**{
+            name: getattr(self, name)[indices] for name in self.__dataclass_fields__
+        })
+
+    def merge(self, other):
+        """合併兩份快照並依 id 重新排序"""
+        merged = {
+            name: np.concatenate([getattr(self, name), getattr(other, name)])
+            for name in self.__dataclass_fields__
+        }
+        order = np.argsort(merged['ids'], kind='stable')
+        return CatalogSnapshot(**{name: values[order] for name, values in merged.items()})
+
+
+class ProductCatalog:
+    """
+    推薦用的商品目錄快照
+
+    第一次使用時以單一查詢載入所需欄位，之後透過 SQLAlchemy 事件追蹤
+    商品的新增、修改與刪除，在交易提交後只重新讀取有變動的商品；
+    以 Core 語句寫入的程式需呼叫 track_changes、mark_changed 或 invalidate。
+    其他程序（例如 food_data_reader 匯入、排程執行的 archive-products）的寫入無法由事件得知，
+    因此每次取得快照時比對商品數與最大 id，不同時（有商品新增或刪除）整份重建，
+    其他程序就地修改的商品則由 max_age 涵蓋：快照超過 max_age 秒一律重建。
+    快照只包含在架商品（有庫存且未過期），過期的商品在取得快照時移除。
+
+    Args:
+        db: Flask-SQLAlchemy 物件
+        model: 商品模型
+        max_age (float): 快照最長沿用秒數，None 表示不限
+    """
+
+    def __init__(self, db, model, max_age=None):
+        self._db = db
+        self._model = model
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = None
+        self._version = None
+        self._pending_ids = set()
+        self._session_key = f'catalog_changed_{model.__tablename__}'
+
+        for identifier in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, identifier, self._track_change)
+        event.listen(Session, 'after_commit', self._publish_changes)
+        event.listen(Session, 'after_rollback', self._discard_changes)
+
+    def _track_change(self, mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            self.track_changes(session, [target.id])
+
+    def track_changes(self, session, ids):
+        """
+        標記 session 中以 Core 語句變動的商品，交易提交後才生效，回滾時捨棄（與 ORM 事件相同）
+
+        Args:
+            session: SQLAlchemy session
+            ids (iterable[int]): 變動的商品 id
+        """
+        session.info.setdefault(self._session_key, set()).update(ids)
+
+    def _publish_changes(self, session):
+        changed_ids = session.info.pop(self._session_key, None)
+        if changed_ids:
+            with self._lock:
+                self._pending_ids |= changed_ids
+
+    def _discard_changes(self, session):
+        session.info.pop(self._session_key, None)
+
+    def invalidate(self):
+        """捨棄目前快照，下次使用時整份重建（例如以 Core 語句大量匯入後）"""
+        with self._lock:
+            self._snapshot = None
+            self._pending_ids.clear()
+
+    def _current_version(self):
+        """商品表的商品數與最大 id：其他程序新增或刪除商品時會改變（兩者都只需讀索引）"""
+        model = self._model
+        return tuple(self._db.session.execute(select(
+            select(func.count()).select_from(model).scalar_subquery(),
+            select(func.max(model.id)).scalar_subquery()
+        )).one())
+
+    def mark_changed(self, ids):
+        """標記在 ORM 之外變動的商品（例如被封存），下次取得快照時重新讀取"""
+        with self._lock:
+            self._pending_ids.update(ids)
+
+    def _load(self, ids=None):
+        model = self._model
+        stmt = select(
+            model.id, model.discounted_price,
+            model.latitude, model.longitude, model.expiry_date, model.nutrition_info
+        ).where(active_filter(model)).order_by(model.id)
+        if ids is not None:
+            stmt = stmt.where(model.id.in_(list(ids)))
+        return CatalogSnapshot.from_rows(self._db.session.execute(stmt).all())
+
+    def snapshot(self):
+        """
+        取得最新的商品目錄快照
+
+        Returns:
+            CatalogSnapshot: 目前所有在架商品的欄位式快照
+        """
+        with self._lock:
+            pending_ids = self._pending_ids
+            self._pending_ids = set()
+
+            # 商品數或最大 id 改變表示有商品新增或刪除，無法分辨是否來自其他程序，一律整份重建；
+            # 本程序的修改不會改變兩者，仍只重新讀取有變動的商品
+            version = self._current_version()
+            expired = (self._max_age is not None and self._loaded_at is not None
+                       and time.monotonic() - self._loaded_at > self._max_age)
+            if expired or version != self._version:
+                self._snapshot = None
+            self._version = version
+
+            if self._snapshot is None or len(pending_ids) > _REBUILD_RATIO * len(self._snapshot):
+                self._snapshot = self._load()
+                self._loaded_at = time.monotonic()
+            elif pending_ids:
+                ids = np.fromiter(pending_ids, dtype=np.int64)
+                unchanged = self._snapshot.take(~np.isin(self._snapshot.ids, ids))
+                self._snapshot = unchanged.merge(self._load(pending_ids))
+
+            # 移除載入後才過期的商品
+            live = self._snapshot.expiry_date >= np.datetime64(expiry_cutoff(), 's')
+            if not live.all():
+                self._snapshot = self._snapshot.take(live)
+
+            return self._snapshot
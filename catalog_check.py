@@ -0,0 +1,104 @@
+"""
+商品目錄快照一致性檢查：其他連線（程序）的寫入與本程序的寫入同時發生時，快照是否仍與資料庫一致
+
+使用暫存的 SQLite 資料庫（透過 DATABASE_URL），不會動到 instance/food_platform.db。
+每個情境都先以另一條 sqlite3 連線新增或刪除商品（ORM 事件看不到），再在本程序修改商品或加入購物車，
+之後取得的快照必須等於資料庫中所有在架商品。
+
+用法（在專案根目錄執行）：
+    python catalog_check.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+
+def main():
+    # 必須在匯入 app 之前設定，讓 app 使用暫存資料庫
+    db_path = os.path.join(tempfile.mkdtemp(prefix='catalog_check_'), 'catalog_check.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    from sqlalchemy import select
+    from werkzeug.security import generate_password_hash
+    from app import app, db, User, Product, product_catalog
+    from inventory import active_filter
+
+    # 只檢查商品目錄，不啟動模型預先載入與背景封存
+    app.config['NUTRITION_MODEL_WARMUP'] = False
+    app.config['INVENTORY_SWEEP_INTERVAL'] = 0
+
+    expiry_date = datetime.now() + timedelta(days=30)
+    password = 'check'
+    with app.app_context():
+        db.create_all()
+        store = User(username='check_store', email='check_store@example.com', is_store=True)
+        customer = User(username='check_user', email='check_user@example.com',
+                        password_hash=generate_password_hash(password))
+        db.session.add_all([store, customer])
+        db.session.flush()
+        store_id = store.id
+        db.session.add_all([
+            Product(name=f'Check product {i}', quantity=10, address='none', expiry_date=expiry_date,
+                    original_price=100, discount_rate=0.5, store_id=store_id)
+            for i in range(10)
+        ])
+        db.session.commit()
+
+    external = sqlite3.connect(db_path)
+    client = app.test_client()
+    client.post('/login', data={'username': 'check_user', 'password': password})
+
+    def external_insert(count):
+        external.executemany(
+            'INSERT INTO product (name, quantity, address, expiry_date, original_price, discount_rate, '
+            'discounted_price, store_id, cart_count) VALUES (?, 10, ?, ?, 100, 0.5, 50, ?, 0)',
+            [(f'External product {i}', 'none', expiry_date.isoformat(' '), store_id) for i in range(count)]
+        )
+        external.commit()
+
+    def external_delete(count):
+        external.execute('DELETE FROM product WHERE id IN (SELECT id FROM product ORDER BY id DESC LIMIT ?)', (count,))
+        external.commit()
+
+    def orm_update():
+        product = db.session.scalars(select(Product).order_by(Product.id)).first()
+        product.discount_rate = product.discount_rate / 2
+        db.session.commit()
+
+    def add_to_cart():
+        product_id = db.session.scalar(select(Product.id).order_by(Product.id))
+        response = client.post(f'/add_to_cart/{product_id}')
+        assert response.status_code == 200, response.status_code
+
+    scenarios = [
+        ('external insert + ORM update', lambda: external_insert(5), orm_update),
+        ('external insert + add_to_cart', lambda: external_insert(5), add_to_cart),
+        ('external delete + ORM update', lambda: external_delete(3), orm_update),
+        ('external delete + add_to_cart', lambda: external_delete(3), add_to_cart),
+    ]
+
+    ok = True
+    with app.app_context():
+        product_catalog.snapshot()
+        for name, external_write, local_write in scenarios:
+            external_write()
+            local_write()
+            snapshot = product_catalog.snapshot()
+            rows = db.session.execute(
+                select(Product.id, Product.discounted_price).where(active_filter(Product)).order_by(Product.id)
+            ).all()
+            consistent = (snapshot.ids.tolist() == [row[0] for row in rows]
+                          and snapshot.discounted_price.tolist() == [row[1] for row in rows])
+            print(f"{name}: snapshot {len(snapshot)} products, database {len(rows)}, "
+                  f"{'consistent' if consistent else 'STALE'}")
+            ok &= consistent
+
+    external.close()
+    print('OK: catalog snapshot follows external and in-process writes' if ok else 'FAILED: catalog snapshot is stale')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
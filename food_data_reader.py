@@ -1,11 +1,16 @@
 import pandas as pd
+import numpy as np
 import os
+import time
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, insert, select, update
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash
 import json
 from flask_login import UserMixin
+from geo import encode_geohash_array
+from train.food_csv import CHUNK_SIZE, read_food_csv
 
 # 初始化 Flask 應用程式和資料庫
 app = Flask(__name__)
@@ -14,6 +19,36 @@ app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "inst
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
+# 匯入商品時的預設值
+DEFAULT_QUANTITY = 10
+DEFAULT_ADDRESS = "none"
+DEFAULT_ORIGINAL_PRICE = 100.0
+DEFAULT_DISCOUNT_RATE = 0.8
+
+# CSV 欄位與 nutrition_info 鍵名的對應
+NUTRITION_COLUMNS = {
+    'energy': 'energy',
+    'protein': 'protein',
+    'total_lipid_fat': 'fat',
+    'carbohydrate_by_difference': 'carbohydrate',
+    'fiber_total_dietary': 'fiber',
+    'total_sugars': 'sugars',
+    'sodium_na': 'sodium'
+}
+
+# 大量匯入時每個交易寫入的筆數
+BULK_CHUNK_SIZE = 5000
+
+# 大量匯入期間使用的 SQLite 設定（匯入結束後還原）
+BULK_SQLITE_PRAGMAS = {
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': -64000
+}
+
+# 依名稱更新既有商品時覆寫的欄位
+UPSERT_COLUMNS = ('latitude', 'longitude', 'geohash', 'nutrition_info')
+
 # 定義使用者模型
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -37,6 +72,14 @@ class Product(db.Model):
     discount_rate = db.Column(db.Float, nullable=False)
     nutrition_info = db.Column(db.JSON)
     store_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    geohash = db.Column(db.String(12), index=True)
+    discounted_price = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_product_discounted_price_expiry_date', 'discounted_price', 'expiry_date'),
+        db.Index('ix_product_store_id_expiry_date', 'store_id', 'expiry_date'),
+        db.Index('ix_product_active_expiry_date', 'expiry_date', sqlite_where=db.text('quantity > 0')),
+    )
 
 def create_admin_user():
     """創建管理員用戶"""
@@ -57,23 +100,36 @@ def create_admin_user():
             print("已創建管理員用戶")
         return admin.id
 
-def read_food_data(file_path='.csv'):
+def read_food_data(file_path='.csv', chunk_size=None, drop_zero_rows=False, drop_missing=False):
     """
     讀取食物資料清單
     
+    指定 chunk_size 時改為分段讀取，回傳 DataFrame 的迭代器，記憶體用量只與 chunk_size 有關，
+    可直接交給 save_to_database。營養素欄位以 float64 讀取，寫入 nutrition_info 的數值才會與 CSV 相同。
+    
     Args:
         file_path (str): CSV檔案的路徑
+        chunk_size (int): 每段的筆數，None 表示一次讀取整份檔案
+        drop_zero_rows (bool): 移除營養素全為 0 的資料
+        drop_missing (bool): 移除營養素有缺漏的資料
         
     Returns:
-        pd.DataFrame: 包含食物資料的DataFrame
+        pd.DataFrame: 包含食物資料的DataFrame（指定 chunk_size 時為 DataFrame 的迭代器）
     """
     try:
         # 檢查檔案是否存在
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"找不到檔案: {file_path}")
             
+        chunks = read_food_csv(
+            file_path, list(NUTRITION_COLUMNS), chunk_size or CHUNK_SIZE,
+            drop_zero_rows=drop_zero_rows, drop_missing=drop_missing, nutrient_dtype=np.float64
+        )
+        if chunk_size:
+            return chunks
+
         # 讀取CSV檔案
-        df = pd.read_csv(file_path)
+        df = pd.concat(chunks, ignore_index=True)
         
         # 顯示基本資訊
         print(f"成功讀取 {len(df)} 筆食物資料")
@@ -87,66 +143,167 @@ def read_food_data(file_path='.csv'):
         print(f"讀取檔案時發生錯誤: {str(e)}")
         return None
 
-def save_to_database(df):
+def _apply_bulk_pragmas(conn):
     """
-    將DataFrame資料儲存到資料庫
-    
+    調整 SQLite 設定以加快大量寫入，回傳原本的設定以便還原
+
+    synchronous=OFF 省去每次提交的 fsync，temp_store 與 cache_size 讓索引更新留在記憶體中。
+    """
+    if conn.dialect.name != 'sqlite':
+        return {}
+    previous = {
+        name: conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+        for name in BULK_SQLITE_PRAGMAS
+    }
+    for name, value in BULK_SQLITE_PRAGMAS.items():
+        conn.exec_driver_sql(f'PRAGMA {name}={value}')
+    conn.commit()
+    return previous
+
+
+def _build_product_rows(df, store_id):
+    """
+    以欄位運算建立要寫入 product 資料表的資料列
+
     Args:
         df (pd.DataFrame): 食物資料DataFrame
+        store_id (int): 商品所屬的商家 ID
+
+    Returns:
+        list[dict]: 每筆商品的欄位值
+    """
+    # 營養成分：先整欄轉成浮點數，再一次轉成 dict
+    nutrition = (
+        df[list(NUTRITION_COLUMNS)]
+        .astype(float)
+        .rename(columns=NUTRITION_COLUMNS)
+        .to_dict('records')
+    )
+
+    # 資料沒有經緯度欄位時，座標與 geohash 留空
+    lats = df['latitude'].astype(float).to_numpy() if 'latitude' in df.columns else np.full(len(df), np.nan)
+    lons = df['longitude'].astype(float).to_numpy() if 'longitude' in df.columns else np.full(len(df), np.nan)
+    geohashes = encode_geohash_array(lats, lons)
+
+    # 設定預設值
+    default_expiry_date = datetime.now() + timedelta(days=7)
+    names = df['食物名稱'].astype(str).tolist()
+
+    return [
+        {
+            'name': name,
+            'quantity': DEFAULT_QUANTITY,
+            'address': DEFAULT_ADDRESS,
+            'latitude': None if np.isnan(lat) else float(lat),
+            'longitude': None if np.isnan(lon) else float(lon),
+            'geohash': geohash,
+            'expiry_date': default_expiry_date,
+            'original_price': DEFAULT_ORIGINAL_PRICE,
+            'discount_rate': DEFAULT_DISCOUNT_RATE,
+            'discounted_price': DEFAULT_ORIGINAL_PRICE * DEFAULT_DISCOUNT_RATE,
+            'nutrition_info': nutrition_info,
+            'store_id': store_id
+        }
+        for name, lat, lon, geohash, nutrition_info in zip(names, lats, lons, geohashes, nutrition)
+    ]
+
+
+def save_to_database(df, chunk_size=BULK_CHUNK_SIZE, upsert=False):
+    """
+    將DataFrame資料大量寫入資料庫
+
+    資料列以欄位運算一次建立，再以 Core insert 分批寫入，每批一個交易。
+
+    Args:
+        df (pd.DataFrame): 食物資料DataFrame，或 read_food_data(chunk_size=...) 回傳的迭代器
+        chunk_size (int): 每個交易寫入的筆數
+        upsert (bool): 依食物名稱更新管理員已有的商品（營養成分與位置），
+            其餘商品才新增；False 時全部新增
     """
     if df is None:
         return
-        
+    chunks = [df] if isinstance(df, pd.DataFrame) else df
+
     try:
         with app.app_context():
             # 確保資料表存在
             db.create_all()
-            
+
             # 確保管理員用戶存在
             admin_id = create_admin_user()
-            
-            # 設定預設值
-            default_quantity = 10
-            default_address = "none"
-            default_expiry_date = datetime.now() + timedelta(days=7)
-            default_original_price = 100.0
-            default_discount_rate = 0.8
-            
-            # 新增資料
-            for _, row in df.iterrows():
-                # 準備營養成分資料
-                nutrition_info = {
-                    'energy': float(row['energy']),
-                    'protein': float(row['protein']),
-                    'fat': float(row['total_lipid_fat']),
-                    'carbohydrate': float(row['carbohydrate_by_difference']),
-                    'fiber': float(row['fiber_total_dietary']),
-                    'sugars': float(row['total_sugars']),
-                    'sodium': float(row['sodium_na'])
-                }
-                
-                # 創建新的Product實例
-                product = Product(
-                    name=row['食物名稱'],
-                    quantity=default_quantity,
-                    address=default_address,
-                    latitude=float(row['latitude']),
-                    longitude=float(row['longitude']),
-                    expiry_date=default_expiry_date,
-                    original_price=default_original_price,
-                    discount_rate=default_discount_rate,
-                    nutrition_info=nutrition_info,
-                    store_id=admin_id
-                )
-                db.session.add(product)
-            
-            # 提交變更
-            db.session.commit()
-            print(f"\n成功將 {len(df)} 筆資料儲存到資料庫")
-            
+
+            started = time.perf_counter()
+            table = Product.__table__
+            inserted = 0
+            updated = 0
+
+            with db.engine.connect() as conn:
+                previous_pragmas = _apply_bulk_pragmas(conn)
+                try:
+                    existing = {}
+                    if upsert:
+                        existing = dict(conn.execute(
+                            select(table.c.name, table.c.id).where(table.c.store_id == admin_id)
+                        ).all())
+                        conn.commit()
+
+                    for frame in chunks:
+                        rows = _build_product_rows(frame, admin_id)
+                        updates = []
+                        if upsert:
+                            # 同名的資料只保留最後一筆
+                            rows = list({row['name']: row for row in rows}.values())
+                            updates = [
+                                {
+                                    'target_id': existing[row['name']],
+                                    **{key: row[key] for key in UPSERT_COLUMNS}
+                                }
+                                for row in rows if row['name'] in existing
+                            ]
+                            rows = [row for row in rows if row['name'] not in existing]
+
+                        _write_chunks(conn, table, rows, updates, chunk_size)
+                        inserted += len(rows)
+                        updated += len(updates)
+
+                        if upsert and rows:
+                            # 記下新增商品的 ID，後續分段出現同名資料時改為更新
+                            new_names = {row['name'] for row in rows}
+                            existing.update(
+                                (name, product_id) for name, product_id in conn.execute(
+                                    select(table.c.name, table.c.id)
+                                    .where(table.c.store_id == admin_id)
+                                    .order_by(table.c.id.desc())
+                                    .limit(len(rows))
+                                ).all()
+                                if name in new_names
+                            )
+                            conn.commit()
+                finally:
+                    conn.rollback()
+                    for name, value in previous_pragmas.items():
+                        conn.exec_driver_sql(f'PRAGMA {name}={value}')
+                    conn.commit()
+
+            elapsed = time.perf_counter() - started
+            total = inserted + updated
+            print(f"\n成功將 {total} 筆資料儲存到資料庫（新增 {inserted} 筆，更新 {updated} 筆），"
+                  f"耗時 {elapsed:.2f} 秒（{total / max(elapsed, 1e-9):.0f} 筆/秒）")
+
     except Exception as e:
         print(f"儲存資料時發生錯誤: {str(e)}")
-        db.session.rollback()
+
+
+def _write_chunks(conn, table, rows, updates, chunk_size):
+    """以每 chunk_size 筆一個交易的方式寫入更新與新增的資料"""
+    update_stmt = update(table).where(table.c.id == bindparam('target_id'))
+    for i in range(0, len(updates), chunk_size):
+        with conn.begin():
+            conn.execute(update_stmt, updates[i:i + chunk_size])
+    for i in range(0, len(rows), chunk_size):
+        with conn.begin():
+            conn.execute(insert(table), rows[i:i + chunk_size])
+
 
 def verify_database():
     """
@@ -0,0 +1,207 @@
+import math
+
+import numpy as np
+from geopy.distance import geodesic
+
+# Geohash 使用的 base32 字元表
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# 儲存在資料庫中的 geohash 精度（9 碼約 5 公尺見方）
+GEOHASH_PRECISION = 9
+
+# 地球平均半徑（公里），haversine 使用
+EARTH_RADIUS_KM = 6371.0088
+
+# 支援的距離計算模式：haversine（球面近似，預設）與 geodesic（橢球體精確值）
+DISTANCE_MODES = ('haversine', 'geodesic')
+
+# 赤道上一度經度的最短公里數（取球面與橢球體中較小者），用來保守估計涵蓋範圍
+KM_PER_DEGREE = 111.19
+
+# 一度緯度的最短長度（赤道附近），用來保守估計涵蓋範圍
+_KM_PER_DEGREE_LAT_MIN = 110.57
+
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """
+    將經緯度編碼為 geohash 字串
+
+    Args:
+        lat (float): 緯度
+        lon (float): 經度
+        precision (int): geohash 長度
+
+    Returns:
+        str: geohash 字串，經緯度缺漏時回傳 None
+    """
+    if lat is None or lon is None:
+        return None
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash 從經度開始交錯編碼
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def encode_geohash_array(lats, lons, precision=GEOHASH_PRECISION):
+    """
+    以陣列運算一次編碼多組經緯度，結果與逐筆呼叫 encode_geohash 相同
+
+    Args:
+        lats (array-like): 緯度，NaN 表示缺漏
+        lons (array-like): 經度，NaN 表示缺漏
+        precision (int): geohash 長度
+
+    Returns:
+        list[str]: geohash 字串，經緯度缺漏時為 None
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+
+    # 經緯度先量化成格子索引，再把兩者的位元交錯（從經度開始）
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    lon_index = np.floor((np.where(valid, lons, 0) + 180.0) / 360.0 * 2 ** lon_bits).astype(np.int64)
+    lat_index = np.floor((np.where(valid, lats, 0) + 90.0) / 180.0 * 2 ** lat_bits).astype(np.int64)
+    lon_index = np.clip(lon_index, 0, 2 ** lon_bits - 1)
+    lat_index = np.clip(lat_index, 0, 2 ** lat_bits - 1)
+
+    codes = np.zeros(len(lats), dtype=np.int64)
+    for bit in range(precision * 5):
+        if bit % 2 == 0:
+            value = (lon_index >> (lon_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_index >> (lat_bits - 1 - bit // 2)) & 1
+        codes = (codes << 1) | value
+
+    # 每 5 個位元對應一個 base32 字元，組成 (n, precision) 的字元矩陣後直接轉成字串
+    alphabet = np.frombuffer(_BASE32.encode('ascii'), dtype=np.uint8)
+    shifts = 5 * np.arange(precision - 1, -1, -1)
+    chars = np.ascontiguousarray(alphabet[(codes[:, np.newaxis] >> shifts) & 31])
+    hashes = chars.view(f'S{precision}').ravel().astype(f'U{precision}')
+    return [value if ok else None for value, ok in zip(hashes.tolist(), valid)]
+
+
+def _cell_size(precision):
+    """回傳指定精度下單一 geohash 格子的 (緯度高, 經度寬)，單位為度"""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def geohash_cover(lat, lon, radius_km, max_cells=16):
+    """
+    計算涵蓋以 (lat, lon) 為圓心、radius_km 為半徑範圍的 geohash 前綴
+
+    會選擇格子數不超過 max_cells 的最高精度，讓候選範圍盡量小。
+
+    Args:
+        lat (float): 圓心緯度
+        lon (float): 圓心經度
+        radius_km (float): 半徑（公里）
+        max_cells (int): 最多回傳的前綴數量
+
+    Returns:
+        list[str]: geohash 前綴清單
+    """
+    dlat = radius_km / _KM_PER_DEGREE_LAT_MIN
+    lat_min = max(lat - dlat, -90.0)
+    lat_max = min(lat + dlat, 90.0)
+
+    # 經度寬度以範圍內最靠近極區的緯度計算，確保不會漏掉邊緣
+    cos_lat = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    dlon = 180.0 if cos_lat < 1e-6 else min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    lon_min = lon - dlon
+    lon_max = lon + dlon
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_h, cell_w = _cell_size(precision)
+        row_min = math.floor((lat_min + 90.0) / cell_h)
+        row_max = min(math.floor((lat_max + 90.0) / cell_h), round(180.0 / cell_h) - 1)
+        col_min = math.floor((lon_min + 180.0) / cell_w)
+        col_max = math.floor((lon_max + 180.0) / cell_w)
+        cols_total = round(360.0 / cell_w)
+        num_cols = min(col_max - col_min + 1, cols_total)
+        num_cells = (row_max - row_min + 1) * num_cols
+
+        if num_cells > max_cells and precision > 1:
+            continue
+
+        prefixes = set()
+        for row in range(row_min, row_max + 1):
+            cell_lat = -90.0 + (row + 0.5) * cell_h
+            for col in range(col_min, col_min + num_cols):
+                # 經度跨越 ±180 度時繞回
+                cell_lon = -180.0 + ((col % cols_total) + 0.5) * cell_w
+                prefixes.add(encode_geohash(cell_lat, cell_lon, precision))
+        return sorted(prefixes)
+
+    return []
+
+
+def distances_km(lat, lon, lats, lons, mode='haversine'):
+    """
+    一次計算多個商品座標到使用者位置的距離
+
+    Args:
+        lat (float): 使用者緯度
+        lon (float): 使用者經度
+        lats (array-like): 商品緯度陣列，缺漏值可為 None 或 NaN
+        lons (array-like): 商品經度陣列，缺漏值可為 None 或 NaN
+        mode (str): 'haversine' 使用 NumPy 向量化球面公式；
+            'geodesic' 使用 geopy 的橢球體演算法逐一計算
+
+    Returns:
+        np.ndarray: 距離（公里），座標缺漏者為 NaN
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    if mode == 'haversine':
+        lat1 = math.radians(lat)
+        lat2 = np.radians(lats)
+        dlat = lat2 - lat1
+        dlon = np.radians(lons) - math.radians(lon)
+        a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    if mode == 'geodesic':
+        result = np.full(lats.shape, np.nan)
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        result[valid] = [
+            geodesic((lat, lon), (p_lat, p_lon)).kilometers
+            for p_lat, p_lon in zip(lats[valid], lons[valid])
+        ]
+        return result
+
+    raise ValueError(f"Unknown distance mode: {mode}")
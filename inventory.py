@@ -0,0 +1,145 @@
+import threading
+from datetime import datetime
+
+from sqlalchemy import and_, case, delete, insert, literal, or_, select
+
+# 每個交易封存的商品數，避免長時間鎖住資料表
+ARCHIVE_BATCH_SIZE = 500
+
+# 封存原因
+ARCHIVE_EXPIRED = 'expired'
+ARCHIVE_SOLD_OUT = 'sold_out'
+
+
+def expiry_cutoff(now=None):
+    """
+    回傳有效期限的下限：到期日早於今天 0 點的商品視為過期
+
+    到期日只記錄到日期，因此商品在到期當天仍可販售。
+    """
+    now = now or datetime.now()
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def active_filter(model, now=None):
+    """
+    在架商品的篩選條件：仍有庫存且尚未過期
+
+    quantity > 0 與部分索引 ix_product_active_expiry_date 的條件相同，SQLite 才能使用該索引。
+
+    Args:
+        model: 商品模型
+        now (datetime): 目前時間，預設為 datetime.now()
+
+    Returns:
+        SQL 條件式
+    """
+    return and_(model.quantity > 0, model.expiry_date >= expiry_cutoff(now))
+
+
+class InventorySweeper:
+    """
+    將過期或售完的商品移到封存資料表
+
+    商品列以 INSERT ... SELECT 複製到封存表後，再從商品表刪除（同一個交易），
+    商品表因此只保留在架商品，列表、搜尋與推薦的成本隨目前庫存而非歷史總量成長。
+    全文檢索索引由商品表的刪除觸發器同步；購物車中已封存商品的項目一併移除。
+    """
+
+    def __init__(self, db, model, archive_model, cart_model=None, on_archived=None):
+        """
+        Args:
+            db: Flask-SQLAlchemy 物件
+            model: 商品模型
+            archive_model: 封存商品模型，欄位與商品模型相同並另有 archived_at、archive_reason
+            cart_model: 購物車項目模型（有 product_id 欄位），None 時不處理購物車
+            on_archived (callable): 每批封存後以商品 id 清單呼叫，例如通知快取更新
+        """
+        self._db = db
+        self._table = model.__table__
+        self._archive = archive_model.__table__
+        self._cart = cart_model.__table__ if cart_model is not None else None
+        self._on_archived = on_archived
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sweep(self, now=None, batch_size=ARCHIVE_BATCH_SIZE):
+        """
+        封存所有過期或售完的商品（需在 app context 中呼叫）
+
+        Args:
+            now (datetime): 目前時間，預設為 datetime.now()
+            batch_size (int): 每個交易封存的筆數
+
+        Returns:
+            dict: 各封存原因的筆數
+        """
+        now = now or datetime.now()
+        table = self._table
+        expired = table.c.expiry_date < expiry_cutoff(now)
+        sold_out = table.c.quantity <= 0
+        columns = [col.name for col in self._archive.columns if col.name in table.c]
+        reason = case((sold_out, ARCHIVE_SOLD_OUT), else_=ARCHIVE_EXPIRED)
+
+        counts = {ARCHIVE_EXPIRED: 0, ARCHIVE_SOLD_OUT: 0}
+        while True:
+            with self._db.engine.begin() as conn:
+                rows = conn.execute(
+                    select(table.c.id, reason).where(or_(expired, sold_out)).order_by(table.c.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                ids = [row[0] for row in rows]
+
+                conn.execute(insert(self._archive).from_select(
+                    columns + ['archived_at', 'archive_reason'],
+                    select(*[table.c[name] for name in columns], literal(now), reason)
+                    .where(table.c.id.in_(ids))
+                ))
+                if self._cart is not None:
+                    conn.execute(delete(self._cart).where(self._cart.c.product_id.in_(ids)))
+                conn.execute(delete(table).where(table.c.id.in_(ids)))
+
+            for _, row_reason in rows:
+                counts[row_reason] += 1
+            if self._on_archived is not None:
+                self._on_archived(ids)
+            if len(rows) < batch_size:
+                break
+
+        return counts
+
+    def start(self, app, interval):
+        """
+        啟動背景執行緒，每 interval 秒封存一次
+
+        Args:
+            app: Flask 應用程式，用來建立 app context
+            interval (float): 兩次封存之間的秒數
+
+        Returns:
+            threading.Thread: 背景執行緒
+        """
+        def run():
+            while not self._stop.is_set():
+                try:
+                    with app.app_context():
+                        counts = self.sweep()
+                    if any(counts.values()):
+                        print(f"Archived {counts[ARCHIVE_EXPIRED]} expired and "
+                              f"{counts[ARCHIVE_SOLD_OUT]} sold-out products")
+                except Exception as e:
+                    print(f"Inventory sweep failed: {e}")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='inventory-sweeper', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """停止背景執行緒"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -5,6 +5,8 @@ from flask import current_app
 
 from alembic import context
 
+from product_search import SEARCH_TABLE
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -90,9 +92,19 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # the FTS5 search table and its shadow tables are created with raw SQL
+    # by migrations and are not part of the metadata, so autogenerate must
+    # not treat them as removed tables
+    def include_name(name, type_, parent_names):
+        if type_ == 'table':
+            return not name.startswith(SEARCH_TABLE)
+        return True
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
 
     connectable = get_engine()
 
@@ -0,0 +1,45 @@
+"""Add unique cart_item (user_id, product_id) index and recount cart_count
+
+Revision ID: 2f6b8d13a7e5
+Revises: e37a5c90d1f4
+Create Date: 2026-10-17 18:21:37.640195
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f6b8d13a7e5'
+down_revision = 'e37a5c90d1f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 合併並行加入購物車時產生的重複項目：數量加總到 id 最小的一列，其餘刪除
+    op.execute(
+        'UPDATE cart_item SET quantity = ('
+        '    SELECT SUM(c.quantity) FROM cart_item AS c'
+        '    WHERE c.user_id = cart_item.user_id AND c.product_id = cart_item.product_id'
+        ') WHERE id IN ('
+        '    SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id HAVING COUNT(*) > 1'
+        ')'
+    )
+    op.execute(
+        'DELETE FROM cart_item WHERE id NOT IN ('
+        '    SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id'
+        ')'
+    )
+    op.create_index('ix_cart_item_user_id_product_id', 'cart_item', ['user_id', 'product_id'], unique=True)
+
+    # 先前修改數量時沒有更新 cart_count，依購物車內容重新計算
+    op.execute(
+        'UPDATE product SET cart_count = COALESCE(('
+        '    SELECT SUM(quantity) FROM cart_item WHERE cart_item.product_id = product.id'
+        '), 0)'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_cart_item_user_id_product_id', table_name='cart_item')
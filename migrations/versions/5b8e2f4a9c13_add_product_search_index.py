@@ -0,0 +1,26 @@
+"""Add product full-text search index
+
+Revision ID: 5b8e2f4a9c13
+Revises: c69eb71478d0
+Create Date: 2026-10-17 14:05:48.226931
+
+"""
+from alembic import op
+
+from product_search import create_search_index, drop_search_index
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2f4a9c13'
+down_revision = 'c69eb71478d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 虛擬表與同步觸發器，並為既有商品建立索引
+    create_search_index(op.get_bind())
+
+
+def downgrade():
+    drop_search_index(op.get_bind())
@@ -0,0 +1,29 @@
+"""Use AUTOINCREMENT ids for cart_item
+
+Revision ID: 6a1d4c9e3f27
+Revises: 2f6b8d13a7e5
+Create Date: 2026-10-17 22:14:05.318402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1d4c9e3f27'
+down_revision = '2f6b8d13a7e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 重建資料表加上 AUTOINCREMENT，刪除的購物車項目 id 不再被新項目重複使用
+    with op.batch_alter_table('cart_item', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade():
+    with op.batch_alter_table('cart_item', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
@@ -0,0 +1,43 @@
+"""Add indexed product discounted_price and composite filter indexes
+
+Revision ID: 9d41c7e2b6a8
+Revises: 5b8e2f4a9c13
+Create Date: 2026-10-17 15:32:10.584307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from product_search import create_search_index
+
+
+# revision identifiers, used by Alembic.
+revision = '9d41c7e2b6a8'
+down_revision = '5b8e2f4a9c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('discounted_price', sa.Float(), nullable=True))
+
+    # 為既有商品補上折扣後價格，再改為必填
+    op.execute('UPDATE product SET discounted_price = original_price * discount_rate')
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.alter_column('discounted_price', existing_type=sa.Float(), nullable=False)
+        batch_op.create_index('ix_product_discounted_price_expiry_date', ['discounted_price', 'expiry_date'], unique=False)
+        batch_op.create_index('ix_product_store_id_expiry_date', ['store_id', 'expiry_date'], unique=False)
+
+    # batch 模式會重建 product 資料表，原本的全文檢索觸發器隨之消失，需重新建立
+    create_search_index(op.get_bind())
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_store_id_expiry_date')
+        batch_op.drop_index('ix_product_discounted_price_expiry_date')
+        batch_op.drop_column('discounted_price')
+
+    create_search_index(op.get_bind())
@@ -0,0 +1,42 @@
+"""Add product geohash spatial index
+
+Revision ID: c69eb71478d0
+Revises: 4d0fd856cc15
+Create Date: 2026-10-17 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from geo import encode_geohash
+
+
+# revision identifiers, used by Alembic.
+revision = 'c69eb71478d0'
+down_revision = '4d0fd856cc15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        batch_op.create_index(batch_op.f('ix_product_geohash'), ['geohash'], unique=False)
+
+    # 為既有商品補上 geohash
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        'SELECT id, latitude, longitude FROM product '
+        'WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+    )).fetchall()
+    if rows:
+        conn.execute(
+            sa.text('UPDATE product SET geohash = :geohash WHERE id = :id'),
+            [{'id': row.id, 'geohash': encode_geohash(row.latitude, row.longitude)} for row in rows]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_geohash'))
+        batch_op.drop_column('geohash')
@@ -0,0 +1,50 @@
+"""Add active-inventory partial index and archived_product table
+
+Revision ID: e37a5c90d1f4
+Revises: 9d41c7e2b6a8
+Create Date: 2026-10-17 16:48:02.913754
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e37a5c90d1f4'
+down_revision = '9d41c7e2b6a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archived_product',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('address', sa.String(length=200), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=True),
+    sa.Column('longitude', sa.Float(), nullable=True),
+    sa.Column('expiry_date', sa.DateTime(), nullable=False),
+    sa.Column('original_price', sa.Float(), nullable=False),
+    sa.Column('discount_rate', sa.Float(), nullable=False),
+    sa.Column('discounted_price', sa.Float(), nullable=False),
+    sa.Column('nutrition_info', sa.JSON(), nullable=True),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('cart_count', sa.Integer(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.Column('archive_reason', sa.String(length=20), nullable=False),
+    sa.ForeignKeyConstraint(['store_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_archived_product_store_id'), 'archived_product', ['store_id'], unique=False)
+
+    # 只索引仍有庫存的商品（部分索引），不需重建 product 資料表
+    op.create_index('ix_product_active_expiry_date', 'product', ['expiry_date'], unique=False,
+                    sqlite_where=sa.text('quantity > 0'))
+
+
+def downgrade():
+    op.drop_index('ix_product_active_expiry_date', table_name='product')
+    op.drop_index(op.f('ix_archived_product_store_id'), table_name='archived_product')
+    op.drop_table('archived_product')
@@ -0,0 +1,162 @@
+import re
+import threading
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import OperationalError
+
+# 全文檢索虛擬表名稱，以及建立索引的商品欄位
+SEARCH_TABLE = 'product_search'
+SEARCH_COLUMNS = ('name', 'description', 'address')
+
+# bm25 排序時各欄位的權重（順序同 SEARCH_COLUMNS）：名稱命中最重要
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0)
+
+# trigram 分詞器只能用索引比對長度至少 3 個字元的關鍵字，較短的改用 LIKE
+MIN_INDEXED_TERM_LENGTH = 3
+
+
+def _create_statements(table):
+    """回傳建立 FTS5 虛擬表與同步觸發器的 SQL（皆可重複執行）"""
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{col}' for col in SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{col}' for col in SEARCH_COLUMNS)
+    delete_row = (
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values});"
+    )
+    insert_row = f"INSERT INTO {SEARCH_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});"
+    return [
+        # external content 表：索引只存詞彙，內容直接讀商品表；trigram 支援中文與子字串比對
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        f"{columns}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON {table} BEGIN {insert_row} END",
+        f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON {table} BEGIN {delete_row} END",
+        f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE OF {columns} ON {table} "
+        f"BEGIN {delete_row} {insert_row} END"
+    ]
+
+
+def search_objects():
+    """回傳全文檢索需要的資料庫物件名稱（虛擬表與三個觸發器）"""
+    return [SEARCH_TABLE] + [f'{SEARCH_TABLE}_{suffix}' for suffix in ('ai', 'ad', 'au')]
+
+
+def create_search_index(connection, table='product'):
+    """
+    建立商品全文檢索索引，並以目前的商品資料重建索引
+
+    索引由觸發器與商品表同步，因此 ORM、Core 批次匯入或直接執行的 SQL 都會即時反映。
+
+    Args:
+        connection: SQLAlchemy 連線
+        table (str): 商品資料表名稱
+    """
+    for statement in _create_statements(table):
+        connection.execute(text(statement))
+    connection.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+
+
+def drop_search_index(connection):
+    """移除商品全文檢索索引與觸發器"""
+    for name in reversed(search_objects()[1:]):
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+    connection.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+
+
+def parse_search_terms(search):
+    """
+    將搜尋字串依空白切成不重複的關鍵字（保留原順序）
+
+    關鍵字本身就以子字串比對，因此使用者習慣加上的前綴符號 * 會被移除。
+    """
+    terms = (term.strip('*') for term in search.split())
+    return list(dict.fromkeys(term for term in terms if term))
+
+
+def _quote_term(term):
+    """將關鍵字轉成 FTS5 字串，避免其中的符號被當成查詢語法"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    """將關鍵字轉成 LIKE 子字串樣式，跳脫 % 與 _"""
+    return '%' + re.sub(r'([\\%_])', r'\\\1', term) + '%'
+
+
+class ProductSearch:
+    """
+    商品名稱、描述與地址的全文檢索
+
+    使用 SQLite FTS5（trigram 分詞器）建立索引：多個關鍵字需全部命中（可分別命中不同欄位），
+    每個關鍵字以子字串比對，因此同時支援前綴查詢；結果依 bm25 相關性排序。
+    第一次使用時會確認索引存在（例如資料庫由 db.create_all 或 food_data_reader 建立），
+    缺少時自動建立並重建。SQLite 不支援 FTS5 trigram 時 available() 回傳 False。
+    """
+
+    def __init__(self, db, model):
+        self._db = db
+        self._table = model.__tablename__
+        self._lock = threading.Lock()
+        self._available = None
+
+    def available(self):
+        """確認全文檢索索引可用，缺少時建立"""
+        if self._available is None:
+            with self._lock:
+                if self._available is None:
+                    self._available = self._ensure_index()
+        return self._available
+
+    def _ensure_index(self):
+        with self._db.engine.begin() as connection:
+            existing = connection.execute(
+                text('SELECT name FROM sqlite_master WHERE name IN :names').bindparams(
+                    bindparam('names', expanding=True)
+                ),
+                {'names': search_objects()}
+            ).scalars().all()
+            if len(existing) == len(search_objects()):
+                return True
+            try:
+                # 觸發器不存在期間的變動無法得知，因此建立後一律重建索引
+                create_search_index(connection, self._table)
+            except OperationalError as e:
+                print(f"Full-text search unavailable, falling back to LIKE: {e}")
+                return False
+        return True
+
+    def ranked_ids(self, search):
+        """
+        依相關性排序，回傳所有符合搜尋字串的商品 id
+
+        Args:
+            search (str): 搜尋字串，以空白分隔多個關鍵字
+
+        Returns:
+            list[int]: 商品 id，相關性由高到低（同分時依 id）；索引不可用時回傳 None
+        """
+        terms = parse_search_terms(search)
+        if not terms:
+            return None
+        if not self.available():
+            return None
+
+        indexed = [term for term in terms if len(term) >= MIN_INDEXED_TERM_LENGTH]
+        short = [term for term in terms if len(term) < MIN_INDEXED_TERM_LENGTH]
+
+        conditions = []
+        params = {}
+        if indexed:
+            conditions.append(f'{SEARCH_TABLE} MATCH :query')
+            params['query'] = ' '.join(_quote_term(term) for term in indexed)
+        for i, term in enumerate(short):
+            params[f'term{i}'] = _like_pattern(term)
+            conditions.append('(' + ' OR '.join(
+                f"{col} LIKE :term{i} ESCAPE '\\'" for col in SEARCH_COLUMNS
+            ) + ')')
+
+        # 只有短關鍵字時沒有 MATCH 可排序，依 id 排列
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        order = f'bm25({SEARCH_TABLE}, {weights}), rowid' if indexed else 'rowid'
+        sql = f"SELECT rowid FROM {SEARCH_TABLE} WHERE {' AND '.join(conditions)} ORDER BY {order}"
+        return list(self._db.session.execute(text(sql), params).scalars())
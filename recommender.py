@@ -0,0 +1,196 @@
+import time
+
+import numpy as np
+
+# 單品推薦時，每項營養素理想上佔每日需求的比例（約一餐）
+MEAL_SHARE = 0.33
+
+
+def score_products(nutrients, discounted_prices, distances, needs, max_price=None):
+    """
+    以陣列運算一次計算所有商品（可同時對多位使用者）的推薦分數
+
+    Args:
+        nutrients (np.ndarray): (n, 6) 商品營養素矩陣，欄位順序同 catalog.NUTRIENT_KEYS
+        discounted_prices (np.ndarray): (n,) 折扣後價格
+        distances (np.ndarray): (n,) 或 (u, n) 距離（公里），0 表示沒有位置資訊
+        needs (array-like): (6,) 或 (u, 6) 每日營養需求
+        max_price (float): 使用者設定的價格上限，未設定時以所有商品的最高價計算價格分數
+
+    Returns:
+        np.ndarray: needs 為一維時回傳 (n,)，否則回傳 (u, n) 的分數
+    """
+    needs = np.asarray(needs, dtype=np.float64)
+    single_user = needs.ndim == 1
+    needs = np.atleast_2d(needs)
+
+    # 營養分數：各營養素佔需求比例與理想比例的平均差距（差異越小，分數越高）
+    ratios = nutrients[np.newaxis, :, :] / needs[:, np.newaxis, :]
+    nutrition_score = 1 - np.abs(ratios - MEAL_SHARE).sum(axis=2) / nutrients.shape[1]
+
+    # 價格分數（價格越低分數越高），最高價只計算一次
+    price_cap = max_price if max_price else discounted_prices.max()
+    price_score = 1 - discounted_prices / price_cap
+
+    # 有距離時三者加權，沒有位置資訊時只看營養與價格
+    distances = np.broadcast_to(distances, nutrition_score.shape)
+    scores = np.where(
+        distances == 0,
+        0.7 * nutrition_score + 0.3 * price_score,
+        0.5 * nutrition_score + 0.25 / (1 + distances) + 0.25 * price_score
+    )
+    return scores[0] if single_user else scores
+
+
+def top_k(scores, k):
+    """
+    取出分數最高的 k 個位置，依分數由高到低排序（同分時位置較前者優先）
+
+    Args:
+        scores (np.ndarray): (n,) 分數，-inf 表示排除
+        k (int): 要取出的數量
+
+    Returns:
+        np.ndarray: 位置索引
+    """
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def score_meal_sets(totals, total_prices, distance_sums, set_size, needs, price_cap):
+    """
+    計算套餐分數（可一次計算多組）
+
+    Args:
+        totals (np.ndarray): (..., 6) 套餐營養素總和
+        total_prices (np.ndarray): (...,) 套餐總價
+        distance_sums (np.ndarray): (...,) 套餐內商品距離總和
+        set_size (int): 套餐商品數
+        needs (np.ndarray): (6,) 每日營養需求
+        price_cap (float): 價格分數的上限
+
+    Returns:
+        np.ndarray: (...,) 套餐分數
+    """
+    # 營養平衡分數：套餐總營養與每日需求的平均差距（差異越小，分數越高）
+    balance = 1 - np.abs(totals / needs - 1.0).sum(axis=-1) / totals.shape[-1]
+    price_score = 1 - total_prices / price_cap
+    avg_distance = distance_sums / set_size
+    return np.where(
+        avg_distance == 0,
+        0.7 * balance + 0.3 * price_score,
+        0.5 * balance + 0.25 / (1 + avg_distance) + 0.25 * price_score
+    )
+
+
+def search_meal_sets(nutrients, prices, distances, needs, pool, set_size=3, price_cap=None,
+                     budget=None, beam_width=64, num_sets=2, time_limit=None):
+    """
+    以 beam search 在候選商品中搜尋營養最均衡的套餐
+
+    每一層把目前保留的部分套餐各加入一項候選商品，未填滿的名額以候選商品的
+    平均值估計，只保留估計分數最高的 beam_width 組，因此不需要列舉所有組合。
+    超過 time_limit 後 beam 會縮小成 num_sets，退化為貪婪搜尋以便準時回應。
+
+    Args:
+        nutrients (np.ndarray): (n, 6) 商品營養素矩陣
+        prices (np.ndarray): (n,) 折扣後價格
+        distances (np.ndarray): (n,) 距離（公里）
+        needs (array-like): (6,) 每日營養需求
+        pool (np.ndarray): 候選商品的位置索引（通常是單品分數最高的前幾百項）
+        set_size (int): 每組套餐的商品數
+        price_cap (float): 價格分數的上限，預設為候選商品最高價乘以 set_size
+        budget (float): 套餐總價上限
+        beam_width (int): 每層保留的部分套餐數
+        num_sets (int): 回傳的套餐數
+        time_limit (float): 搜尋時間上限（秒）
+
+    Returns:
+        list[tuple[tuple[int, ...], float]]: (商品位置索引, 套餐分數)，依分數由高到低排序
+    """
+    pool = np.asarray(pool, dtype=np.int64)
+    if len(pool) < set_size:
+        return []
+
+    needs = np.asarray(needs, dtype=np.float64)
+    pool_nutrients = nutrients[pool]
+    pool_prices = prices[pool]
+    pool_distances = distances[pool]
+    if price_cap is None:
+        price_cap = pool_prices.max() * set_size
+    if budget is not None and np.sort(pool_prices)[:set_size].sum() > budget:
+        return []
+
+    mean_nutrients = pool_nutrients.mean(axis=0)
+    mean_price = pool_prices.mean()
+    mean_distance = pool_distances.mean()
+    min_price = pool_prices.min()
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+
+    # 每組部分套餐以候選位置（由 0 開始）表示
+    beam = [()]
+    totals = np.zeros((1, nutrients.shape[1]))
+    total_prices = np.zeros(1)
+    distance_sums = np.zeros(1)
+
+    for depth in range(1, set_size + 1):
+        width = beam_width
+        if deadline is not None and time.perf_counter() > deadline:
+            width = num_sets
+
+        # 所有（部分套餐, 候選商品）配對的新總和：(beam, pool, ...)
+        new_totals = totals[:, np.newaxis, :] + pool_nutrients[np.newaxis, :, :]
+        new_prices = total_prices[:, np.newaxis] + pool_prices[np.newaxis, :]
+        new_distances = distance_sums[:, np.newaxis] + pool_distances[np.newaxis, :]
+
+        remaining = set_size - depth
+        if remaining:
+            estimates = score_meal_sets(
+                new_totals + remaining * mean_nutrients,
+                new_prices + remaining * mean_price,
+                new_distances + remaining * mean_distance,
+                set_size, needs, price_cap
+            )
+        else:
+            estimates = score_meal_sets(new_totals, new_prices, new_distances, set_size, needs, price_cap)
+
+        # 排除已在套餐中的商品與不可能符合預算的組合
+        for row, members in enumerate(beam):
+            estimates[row, list(members)] = -np.inf
+        if budget is not None:
+            estimates[new_prices + remaining * min_price > budget] = -np.inf
+
+        # 依估計分數由高到低逐一取出，略過重複的組合，直到填滿 beam
+        flat = estimates.ravel()
+        order = np.argsort(-flat, kind='stable')
+        next_beam, picked, seen = [], [], set()
+        for position in order:
+            if not np.isfinite(flat[position]) or len(next_beam) >= width:
+                break
+            row, col = divmod(int(position), len(pool))
+            members = tuple(sorted(beam[row] + (col,)))
+            if members in seen:
+                continue
+            seen.add(members)
+            next_beam.append(members)
+            picked.append((row, col))
+
+        if not next_beam:
+            return []
+
+        rows, cols = np.array(picked).T
+        beam = next_beam
+        totals = new_totals[rows, cols]
+        total_prices = new_prices[rows, cols]
+        distance_sums = new_distances[rows, cols]
+
+    final_scores = score_meal_sets(totals, total_prices, distance_sums, set_size, needs, price_cap)
+    return [
+        (tuple(int(pool[i]) for i in members), float(score))
+        for members, score in zip(beam[:num_sets], final_scores[:num_sets])
+    ]
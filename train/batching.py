@@ -0,0 +1,143 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    將同時到達的預測請求合併成一個批次送進模型
+
+    背景執行緒會在第一個請求到達後最多等待 max_wait_ms 毫秒，或收集到
+    max_batch_size 個請求後，一次呼叫 predict_batch_fn，再把結果分別交給
+    每個呼叫者的 Future。
+
+    Args:
+        predict_batch_fn (callable): 接收名稱清單並回傳同順序結果清單的函數
+        max_batch_size (int): 每個批次最多的請求數
+        max_wait_ms (float): 收集批次時最多等待的毫秒數
+        history_size (int): 保留最近幾個批次的統計資料
+        timeout (float): predict() 等待結果的預設秒數，None 表示不限
+    """
+
+    def __init__(self, predict_batch_fn, max_batch_size=16, max_wait_ms=5, history_size=1000, timeout=60):
+        self.predict_batch_fn = predict_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._history = deque(maxlen=history_size)
+        self._total_batches = 0
+        self._total_items = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='nutrition-batcher', daemon=True)
+                self._worker.start()
+
+    def submit(self, food_name):
+        """
+        加入一個預測請求
+
+        Args:
+            food_name (str): 食物名稱（英文）
+
+        Returns:
+            Future: 完成後的結果與 predict_batch_fn 回傳的單筆結果相同
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((food_name, future, time.perf_counter()))
+        return future
+
+    def predict(self, food_name, timeout=None):
+        """
+        提交請求並等待結果
+
+        Args:
+            food_name (str): 食物名稱（英文）
+            timeout (float): 等待秒數，None 時使用建構時的 timeout
+
+        Raises:
+            TimeoutError: 超過等待時間仍未完成（請求仍留在批次中，結果會被捨棄）
+        """
+        return self.submit(food_name).result(timeout=self.timeout if timeout is None else timeout)
+
+    def _collect(self):
+        """阻塞直到有請求，再收集同一批次的其餘請求"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            names = [name for name, _, _ in batch]
+            started = time.perf_counter()
+
+            try:
+                results = list(self.predict_batch_fn(names))
+                # 結果數與請求數不符時無法對應，整批視為失敗，避免部分 Future 永遠等不到結果
+                if len(results) != len(batch):
+                    raise ValueError(
+                        f"predict_batch_fn returned {len(results)} results for {len(batch)} inputs"
+                    )
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                results = None
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+
+            finished = time.perf_counter()
+            queue_latencies = [(started - enqueued) * 1000 for _, _, enqueued in batch]
+            with self._lock:
+                self._total_batches += 1
+                self._total_items += len(batch)
+                self._history.append({
+                    'size': len(batch),
+                    'queue_latency_ms': max(queue_latencies),
+                    'mean_queue_latency_ms': sum(queue_latencies) / len(batch),
+                    'inference_ms': (finished - started) * 1000,
+                    'failed': results is None
+                })
+
+    def metrics(self):
+        """
+        回傳批次統計資料
+
+        Returns:
+            dict: 總批次數、總請求數、平均批次大小、目前佇列長度，以及最近批次的
+                大小與佇列延遲（毫秒）
+        """
+        with self._lock:
+            history = list(self._history)
+            total_batches = self._total_batches
+            total_items = self._total_items
+
+        latencies = sorted(record['queue_latency_ms'] for record in history)
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'queue_size': self._queue.qsize(),
+            'total_batches': total_batches,
+            'total_items': total_items,
+            'mean_batch_size': total_items / total_batches if total_batches else 0,
+            'p50_queue_latency_ms': latencies[len(latencies) // 2] if latencies else 0,
+            'p95_queue_latency_ms': latencies[int(len(latencies) * 0.95)] if latencies else 0,
+            'recent_batches': history[-20:]
+        }
@@ -0,0 +1,123 @@
+"""
+Benchmark the training modes of train_model against the plain fp32 loop
+
+Every mode trains for one epoch in its own subprocess, so the reported peak
+RSS belongs to that mode alone.
+
+Usage (from the project root):
+    python -m train.benchmark --data usda/train.csv --limit 2000
+    python -m train.benchmark --data usda/train.csv --modes baseline bf16 --batch-size 16
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# Training options of each mode; 'baseline' is the previous loop (fp32, loss read every step)
+MODES = {
+    'baseline': {'log_every': 1},
+    'log-every': {},
+    'bf16': {'bf16': True},
+    'checkpointing': {'gradient_checkpointing': True},
+    'bf16+checkpointing': {'bf16': True, 'gradient_checkpointing': True}
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def run_mode(args):
+    """Train one epoch with the options of args.run_mode and print the result as JSON"""
+    import torch
+    from torch.utils.data import Subset, random_split
+    from transformers import BertTokenizerFast
+
+    from train.dataset import FoodDataset
+    from train.main import SPLIT_SEED, TRAIN_RATIO, train_model
+    from train.predict import BertForNutrition
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    tokenizer = BertTokenizerFast.from_pretrained(args.bert_model)
+    model = BertForNutrition(args.bert_model)
+    dataset = FoodDataset(args.data, tokenizer)
+    if args.limit:
+        dataset_size = min(args.limit, len(dataset))
+        subset = Subset(dataset, range(dataset_size))
+    else:
+        dataset_size = len(dataset)
+        subset = dataset
+    train_size = int(TRAIN_RATIO * dataset_size)
+    train_dataset, val_dataset = random_split(
+        subset, [train_size, dataset_size - train_size],
+        generator=torch.Generator().manual_seed(SPLIT_SEED)
+    )
+
+    started = time.time()
+    history = train_model(
+        model, train_dataset, val_dataset,
+        num_epochs=1,
+        batch_size=args.batch_size,
+        num_workers=0,
+        **MODES[args.run_mode]
+    )
+    print(json.dumps({
+        'mode': args.run_mode,
+        'epoch_seconds': history[0]['train_seconds'],
+        'total_seconds': time.time() - started,
+        'tokens_per_sec': history[0]['tokens_per_sec'],
+        'train_loss': history[0]['train_loss'],
+        'val_loss': history[0]['val_loss'],
+        'peak_rss_mb': peak_rss_mb()
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark train_model training modes')
+    parser.add_argument('--data', default='usda/train.csv')
+    parser.add_argument('--bert-model', default='bert-base-uncased')
+    parser.add_argument('--limit', type=int, default=2000, help='rows used for the benchmark (0 = all)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threads', type=int, help='torch intra-op threads')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--run-mode', choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args)
+        return
+
+    results = []
+    for mode in args.modes:
+        command = [
+            sys.executable, '-m', 'train.benchmark', '--run-mode', mode,
+            '--data', args.data, '--bert-model', args.bert_model,
+            '--limit', str(args.limit), '--batch-size', str(args.batch_size)
+        ]
+        if args.threads:
+            command += ['--threads', str(args.threads)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+        print(f"finished {mode}", file=sys.stderr)
+
+    baseline = next((r for r in results if r['mode'] == 'baseline'), results[0])
+    print(f"\n{'mode':<20} {'epoch s':>9} {'speedup':>8} {'tokens/s':>10} {'peak RSS MB':>12} {'val loss':>9}")
+    for r in results:
+        print(f"{r['mode']:<20} {r['epoch_seconds']:>9.2f} {baseline['epoch_seconds'] / r['epoch_seconds']:>7.2f}x "
+              f"{r['tokens_per_sec']:>10.0f} {r['peak_rss_mb']:>12.0f} {r['val_loss']:>9.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+模型包（model bundle）：將推論所需的所有資訊存成單一檔案
+
+內容包含模型權重、BERT 結構設定、標準化參數（mean/std）、營養素欄位順序與 tokenizer 設定，
+推論時只需要載入這個檔案，不必再讀取訓練用的 CSV。每次儲存都會產生新的 model_id，
+預測快取以它判斷結果是否屬於目前的模型。
+
+舊的 best_model.pth 可以轉換成模型包（在專案根目錄執行）：
+    python -m train.bundle --model best_model.pth --data usda/train.csv --output model_bundle.pt
+"""
+import argparse
+import uuid
+
+import numpy as np
+import torch
+
+BUNDLE_FORMAT_VERSION = 1
+
+
+def save_model_bundle(path, model, scaler, nutrient_columns, tokenizer, max_length=128):
+    """
+    儲存模型包
+
+    Args:
+        path (str): 輸出檔案路徑
+        model (nn.Module): BertForNutrition 模型
+        scaler (dict): 包含 'mean' 與 'std' 的標準化參數
+        nutrient_columns (list[str]): 模型輸出對應的營養素欄位順序
+        tokenizer: 訓練時使用的 BERT tokenizer
+        max_length (int): tokenizer 的最大序列長度
+    """
+    bundle = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'model_id': uuid.uuid4().hex,
+        'state_dict': {key: value.cpu() for key, value in model.state_dict().items()},
+        'bert_config': model.bert.config.to_dict(),
+        'scaler': {
+            'mean': np.asarray(scaler['mean'], dtype=np.float64).tolist(),
+            'std': np.asarray(scaler['std'], dtype=np.float64).tolist()
+        },
+        'nutrient_columns': list(nutrient_columns),
+        'tokenizer': {
+            'name_or_path': tokenizer.name_or_path,
+            'do_lower_case': tokenizer.do_lower_case,
+            'max_length': max_length
+        }
+    }
+    torch.save(bundle, path)
+
+
+def load_model_bundle(path):
+    """
+    載入模型包
+
+    權重以 mmap 方式載入，只需要標準化參數時不會把整份權重讀進記憶體。
+
+    Args:
+        path (str): 模型包路徑
+
+    Returns:
+        dict: 模型包內容，scaler 的 mean/std 已轉成 NumPy 陣列
+    """
+    bundle = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    if bundle.get('format_version') != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported model bundle format: {bundle.get('format_version')}")
+
+    bundle['scaler'] = {key: np.asarray(value) for key, value in bundle['scaler'].items()}
+    return bundle
+
+
+def main():
+    from transformers import BertTokenizerFast
+
+    from train.dataset import FoodDataset
+    from train.predict import BertForNutrition
+
+    parser = argparse.ArgumentParser(description='Convert a best_model.pth checkpoint into a model bundle')
+    parser.add_argument('--model', required=True, help='state_dict checkpoint (best_model.pth)')
+    parser.add_argument('--data', required=True, help='training CSV used to compute the scaler')
+    parser.add_argument('--bert-model', default='bert-base-uncased')
+    parser.add_argument('--output', default='model_bundle.pt')
+    args = parser.parse_args()
+
+    tokenizer = BertTokenizerFast.from_pretrained(args.bert_model)
+    model = BertForNutrition(args.bert_model)
+    model.load_state_dict(torch.load(args.model, map_location='cpu'))
+
+    dataset = FoodDataset(args.data, tokenizer)
+    save_model_bundle(args.output, model, dataset.get_scaler(), dataset.nutrient_columns, tokenizer, dataset.max_length)
+    print(f"Saved model bundle to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
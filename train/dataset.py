@@ -1,101 +1,330 @@
+import math
 import torch
-from torch.utils.data import Dataset
-import pandas as pd
+from torch.utils.data import Dataset, Sampler, Subset
 import numpy as np
+import hashlib
+import json
+import os
+import shutil
+
+from train.food_csv import NUTRIENT_COLUMNS, CHUNK_SIZE, read_food_csv
+
+# Pre-tokenized datasets are cached in this directory next to the data file
+TOKEN_CACHE_DIRNAME = '.token_cache'
+
+# Bump when the layout of the token cache changes
+TOKEN_CACHE_VERSION = 2
+
+# Names passed to the tokenizer per call when building the cache
+TOKENIZE_BATCH_SIZE = 4096
+
+# Arrays stored in the token cache and their dtypes (BERT vocabularies fit in int32)
+TOKEN_CACHE_ARRAYS = ('input_ids', 'attention_mask', 'targets', 'nutrients')
+TOKEN_CACHE_DTYPES = {
+    'input_ids': np.int32,
+    'attention_mask': np.int8,
+    'targets': np.float32,
+    'nutrients': np.float32
+}
+
+def fit_scaler(nutrients):
+    """Calculate mean/std standardization parameters for an (n, 7) nutrient array"""
+    nutrients = np.asarray(nutrients, dtype=np.float64)
+    mean = np.mean(nutrients, axis=0)
+    std = np.std(nutrients, axis=0)
+    # Avoid division by zero
+    std = np.where(std == 0, 1, std)
+    return {'mean': mean, 'std': std}
+
+def fit_scaler_chunks(chunks, nutrient_columns=NUTRIENT_COLUMNS):
+    """
+    Same as fit_scaler, but accumulated over DataFrame chunks so the whole file
+    never has to be in memory (chunk statistics are merged with Chan's method)
+    """
+    nutrient_columns = list(nutrient_columns)
+    count = 0
+    mean = np.zeros(len(nutrient_columns))
+    m2 = np.zeros(len(nutrient_columns))
+    for chunk in chunks:
+        values = chunk[nutrient_columns].to_numpy(dtype=np.float64)
+        if not len(values):
+            continue
+        chunk_mean = values.mean(axis=0)
+        chunk_m2 = ((values - chunk_mean) ** 2).sum(axis=0)
+        total = count + len(values)
+        delta = chunk_mean - mean
+        mean = mean + delta * len(values) / total
+        m2 = m2 + chunk_m2 + delta ** 2 * count * len(values) / total
+        count = total
+    if not count:
+        raise ValueError("No rows left to compute the scaler")
+
+    std = np.sqrt(m2 / count)
+    # Avoid division by zero
+    std = np.where(std == 0, 1, std)
+    return {'mean': mean, 'std': std}
+
+def _file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def token_cache_key(data_file, tokenizer, max_length, nutrient_columns=NUTRIENT_COLUMNS):
+    """
+    Hash of everything the pre-tokenized arrays depend on: the data file
+    contents, the tokenizer (class, vocabulary, casing), max_length and the
+    nutrient columns
+    """
+    fingerprint = {
+        'version': TOKEN_CACHE_VERSION,
+        'data': _file_sha256(data_file),
+        'tokenizer': type(tokenizer).__name__,
+        'do_lower_case': getattr(tokenizer, 'do_lower_case', None),
+        'vocab': hashlib.sha256(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode('utf-8')).hexdigest(),
+        'max_length': max_length,
+        'nutrient_columns': list(nutrient_columns)
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:16]
 
 class FoodDataset(Dataset):
-    def __init__(self, data_file, tokenizer, max_length=128):
+    def __init__(self, data_file, tokenizer, max_length=128, chunk_size=CHUNK_SIZE, cache_dir=None):
         """
+        The dataset is tokenized once (in batches, so a fast tokenizer is
+        recommended) and stored as .npy files keyed by token_cache_key; later
+        runs memory-map those files instead of reading the CSV or tokenizing.
+
         Args:
             data_file (str): USDA format CSV file path
             tokenizer: BERT tokenizer
             max_length (int): Maximum sequence length
+            chunk_size (int): Rows read from the CSV at a time
+            cache_dir (str): Token cache directory (default: .token_cache next to data_file)
         """
-        # Read the CSV file
-        self.data = pd.read_csv(data_file)
-        print(f"Original dataset size: {len(self.data)}")
-        
         # Nutrient columns
-        self.nutrient_columns = [
-            'sodium_na', 'total_lipid_fat',
-            'carbohydrate_by_difference', 'total_sugars',
-            'fiber_total_dietary', 'energy', 'protein'
-        ]
-        
-        # Validate columns exist
-        missing_cols = [col for col in self.nutrient_columns if col not in self.data.columns]
-        if missing_cols:
-            raise ValueError(f"Missing columns in dataset: {missing_cols}")
-            
-        # Remove rows where all nutrient values are 0
-        mask = (self.data[self.nutrient_columns] != 0).any(axis=1)
-        self.data = self.data[mask]
-        print(f"Dataset size after removing zero-value rows: {len(self.data)}")
-        
-        # Remove rows with missing values
-        self.data = self.data.dropna(subset=self.nutrient_columns)
-        print(f"Dataset size after removing rows with missing values: {len(self.data)}")
-        
+        self.nutrient_columns = list(NUTRIENT_COLUMNS)
         self.tokenizer = tokenizer
         self.max_length = max_length
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_file)), TOKEN_CACHE_DIRNAME)
+        self.cache_path = os.path.join(cache_dir, token_cache_key(data_file, tokenizer, max_length))
+
+        if os.path.exists(os.path.join(self.cache_path, 'meta.json')):
+            print(f"Loading pre-tokenized dataset from {self.cache_path}")
+        else:
+            self._build_cache(data_file, chunk_size)
+
+        with open(os.path.join(self.cache_path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        stats = meta['stats']
+        self._open_arrays()
+        # Real token count of every sample (used for dynamic padding and length bucketing)
+        self.lengths = self.attention_mask.sum(axis=1)
+
+        print(f"Original dataset size: {stats['rows']}")
+        print(f"Dataset size after removing zero-value rows: {stats['after_zero_filter']}")
+        print(f"Dataset size after removing rows with missing values: {stats['after_missing_filter']}")
         
         # Print value ranges for each nutrient
         self._print_nutrient_stats()
         
-        # Standardize nutrient data
-        self.scaler = self._fit_scaler()
+        # Standardization parameters (the cached targets were normalized with the same values)
+        self.scaler = {name: np.asarray(meta['scaler'][name]) for name in ('mean', 'std')}
+
+    def _build_cache(self, data_file, chunk_size):
+        """
+        Stream the CSV in typed chunks (removing rows where all nutrient values
+        are 0 and rows with missing values), tokenize the names in batches and
+        write the arrays to the token cache
+
+        The first pass counts the rows and fits the scaler; the second pass
+        writes every chunk straight into preallocated .npy memmaps, so memory
+        use is bounded by the chunk size rather than the dataset size.
+        """
+        print(f"Tokenizing dataset into {self.cache_path}")
+        stats = {}
+        rows = 0
+
+        def counted(chunks):
+            nonlocal rows
+            for chunk in chunks:
+                rows += len(chunk)
+                yield chunk
+
+        scaler = fit_scaler_chunks(
+            counted(read_food_csv(data_file, self.nutrient_columns, chunk_size, stats=stats)),
+            self.nutrient_columns
+        )
+
+        # Write into a temporary directory and rename it, so an interrupted run never leaves a partial cache
+        tmp_path = f"{self.cache_path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        widths = {
+            'input_ids': self.max_length,
+            'attention_mask': self.max_length,
+            'targets': len(self.nutrient_columns),
+            'nutrients': len(self.nutrient_columns)
+        }
+        arrays = {
+            name: np.lib.format.open_memmap(
+                os.path.join(tmp_path, f'{name}.npy'), mode='w+',
+                dtype=TOKEN_CACHE_DTYPES[name], shape=(rows, widths[name])
+            )
+            for name in TOKEN_CACHE_ARRAYS
+        }
+
+        start = 0
+        for chunk in read_food_csv(data_file, self.nutrient_columns, chunk_size):
+            # English food name is in the first column
+            names = chunk.iloc[:, 0].astype(str).tolist()
+            for i in range(0, len(names), TOKENIZE_BATCH_SIZE):
+                encoding = self.tokenizer(
+                    names[i:i + TOKENIZE_BATCH_SIZE],
+                    add_special_tokens=True,
+                    max_length=self.max_length,
+                    padding='max_length',
+                    truncation=True
+                )
+                # Plain lists convert to NumPy much faster than return_tensors='np'
+                end = start + i + len(encoding['input_ids'])
+                arrays['input_ids'][start + i:end] = encoding['input_ids']
+                arrays['attention_mask'][start + i:end] = encoding['attention_mask']
+            end = start + len(chunk)
+            nutrients = chunk[self.nutrient_columns].to_numpy(dtype=np.float32)
+            arrays['nutrients'][start:end] = nutrients
+            arrays['targets'][start:end] = (nutrients - scaler['mean']) / scaler['std']
+            start = end
+
+        for array in arrays.values():
+            array.flush()
+        del arrays
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'stats': stats,
+                'max_length': self.max_length,
+                'nutrient_columns': self.nutrient_columns,
+                'tokenizer': self.tokenizer.name_or_path,
+                'scaler': {name: scaler[name].tolist() for name in ('mean', 'std')}
+            }, f, indent=2)
+        try:
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            # Another process finished the same cache first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _open_arrays(self):
+        """Memory-map the cached arrays (copy-on-write, so torch.from_numpy can share them)"""
+        for name in TOKEN_CACHE_ARRAYS:
+            setattr(self, name, np.load(os.path.join(self.cache_path, f'{name}.npy'), mmap_mode='c'))
+
+    def __getstate__(self):
+        # Reopen the memmaps in DataLoader worker processes instead of pickling the arrays
+        state = self.__dict__.copy()
+        for name in TOKEN_CACHE_ARRAYS:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open_arrays()
 
     def _print_nutrient_stats(self):
         """Print statistics for each nutrient"""
         print("\nNutrient Statistics:")
-        for col in self.nutrient_columns:
-            stats = self.data[col].describe()
+        for i, col in enumerate(self.nutrient_columns):
+            values = self.nutrients[:, i].astype(np.float64)
             print(f"\n{col}:")
-            print(f"  Min: {stats['min']:.2f}")
-            print(f"  Max: {stats['max']:.2f}")
-            print(f"  Mean: {stats['mean']:.2f}")
-            print(f"  Std: {stats['std']:.2f}")
-
-    def _fit_scaler(self):
-        """Calculate and return statistics for standardization"""
-        nutrients = self.data[self.nutrient_columns].values
-        mean = np.mean(nutrients, axis=0)
-        std = np.std(nutrients, axis=0)
-        # Avoid division by zero
-        std = np.where(std == 0, 1, std)
-        return {'mean': mean, 'std': std}
-
-    def _normalize_nutrients(self, nutrients):
-        """Standardize nutrient data"""
-        return (nutrients - self.scaler['mean']) / self.scaler['std']
+            print(f"  Min: {values.min():.2f}")
+            print(f"  Max: {values.max():.2f}")
+            print(f"  Mean: {values.mean():.2f}")
+            print(f"  Std: {values.std(ddof=1):.2f}")
 
     def __len__(self):
-        return len(self.data)
+        return len(self.input_ids)
 
     def __getitem__(self, idx):
-        # Get English food name from the first column
-        food_name = str(self.data.iloc[idx].iloc[0])
-        nutrients = self.data.iloc[idx][self.nutrient_columns].values.astype(np.float32)
-        
-        # Standardize nutrients
-        nutrients_normalized = self._normalize_nutrients(nutrients)
-
-        # Convert food name to BERT input format
-        encoding = self.tokenizer(
-            food_name,
-            add_special_tokens=True,
-            max_length=self.max_length,
-            padding='max_length',
-            truncation=True,
-            return_tensors='pt'
-        )
-
+        # Views into the memory-mapped arrays, no copy and no tokenization
         return {
-            'input_ids': encoding['input_ids'].flatten(),
-            'attention_mask': encoding['attention_mask'].flatten(),
-            'nutrients': torch.tensor(nutrients_normalized, dtype=torch.float32)
+            'input_ids': torch.from_numpy(self.input_ids[idx]),
+            'attention_mask': torch.from_numpy(self.attention_mask[idx]),
+            'nutrients': torch.from_numpy(self.targets[idx])
         }
         
     def get_scaler(self):
         """Return the scaler for denormalization"""
-        return self.scaler 
+        return self.scaler
+
+
+def sequence_lengths(dataset):
+    """Token counts of a FoodDataset, or of a Subset of one (e.g. from random_split)"""
+    if isinstance(dataset, Subset):
+        return sequence_lengths(dataset.dataset)[np.asarray(dataset.indices)]
+    return dataset.lengths
+
+def dynamic_padding_collate(batch):
+    """
+    Collate FoodDataset samples and trim the padding to the longest sequence
+    in the batch instead of max_length (samples are right-padded, so the
+    trimmed columns are padding in every row)
+    """
+    attention_mask = torch.stack([item['attention_mask'] for item in batch])
+    length = max(int(attention_mask.sum(dim=1).max()), 1)
+    return {
+        'input_ids': torch.stack([item['input_ids'][:length] for item in batch]),
+        'attention_mask': attention_mask[:, :length].contiguous(),
+        'nutrients': torch.stack([item['nutrients'] for item in batch])
+    }
+
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler that groups samples of similar length so dynamic padding
+    has little left to pad
+
+    Indices are shuffled, split into buckets of bucket_size batches, sorted by
+    length inside each bucket and cut into batches; the batch order is then
+    shuffled again. Without shuffle the whole dataset is sorted by length.
+
+    Args:
+        lengths (array-like): Token count of every sample
+        batch_size (int): Samples per batch
+        shuffle (bool): Shuffle samples and batches every epoch
+        bucket_size (int): Batches per bucket (larger means less padding but less randomness)
+        seed (int): Random seed
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_size=100, seed=None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.rng = np.random.default_rng(seed)
+
+    def __iter__(self):
+        n = len(self.lengths)
+        if self.shuffle:
+            order = self.rng.permutation(n)
+            span = self.batch_size * self.bucket_size
+        else:
+            order = np.arange(n)
+            span = max(n, 1)
+
+        batches = []
+        for start in range(0, n, span):
+            bucket = order[start:start + span]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        n = len(self.lengths)
+        if not self.shuffle:
+            return math.ceil(n / self.batch_size)
+        span = self.batch_size * self.bucket_size
+        full, rest = divmod(n, span)
+        return full * self.bucket_size + math.ceil(rest / self.batch_size)
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# 營養素欄位，順序與模型的輸出相同
+NUTRIENT_COLUMNS = [
+    'sodium_na', 'total_lipid_fat',
+    'carbohydrate_by_difference', 'total_sugars',
+    'fiber_total_dietary', 'energy', 'protein'
+]
+
+# 營養素欄位在預測與查詢結果中的名稱與單位
+NUTRIENT_LABELS = {
+    'sodium_na': ('Sodium', 'mg'),
+    'total_lipid_fat': ('Fat', 'g'),
+    'carbohydrate_by_difference': ('Carbohydrate', 'g'),
+    'total_sugars': ('Sugars', 'g'),
+    'fiber_total_dietary': ('Fiber', 'g'),
+    'energy': ('Energy', 'kcal'),
+    'protein': ('Protein', 'g')
+}
+
+# 每段讀取的列數；記憶體用量取決於這個值，而不是檔案大小
+CHUNK_SIZE = 50_000
+
+
+def read_food_csv(path, nutrient_columns=NUTRIENT_COLUMNS, chunk_size=CHUNK_SIZE,
+                  drop_zero_rows=True, drop_missing=True, stats=None, nutrient_dtype=np.float32):
+    """
+    以指定型別分段讀取 USDA／食物 CSV 檔
+
+    第一欄為食物名稱，以 str 讀取；營養素欄位以 nutrient_dtype 讀取（預設 float32）。
+    每讀進一段就套用篩選條件。
+
+    Args:
+        path (str): CSV 檔案路徑
+        nutrient_columns (list[str]): 必須存在的營養素欄位
+        chunk_size (int): 每段的列數
+        drop_zero_rows (bool): 是否移除營養素全為 0 的列
+        drop_missing (bool): 是否移除有營養素缺值的列
+        stats (dict): 可選，用來接收列數統計 'rows'、'after_zero_filter' 與 'after_missing_filter'
+        nutrient_dtype: 營養素欄位的型別
+
+    Yields:
+        pd.DataFrame: 篩選後的一段資料
+    """
+    nutrient_columns = list(nutrient_columns)
+    header = pd.read_csv(path, nrows=0).columns
+    missing_cols = [col for col in nutrient_columns if col not in header]
+    if missing_cols:
+        raise ValueError(f"Missing columns in dataset: {missing_cols}")
+
+    dtype = {col: nutrient_dtype for col in nutrient_columns}
+    dtype[header[0]] = str
+
+    if stats is not None:
+        stats.update(rows=0, after_zero_filter=0, after_missing_filter=0)
+
+    for chunk in pd.read_csv(path, dtype=dtype, chunksize=chunk_size):
+        if stats is not None:
+            stats['rows'] += len(chunk)
+
+        if drop_zero_rows:
+            chunk = chunk[(chunk[nutrient_columns] != 0).any(axis=1)]
+        if stats is not None:
+            stats['after_zero_filter'] += len(chunk)
+
+        if drop_missing:
+            chunk = chunk.dropna(subset=nutrient_columns)
+        if stats is not None:
+            stats['after_missing_filter'] += len(chunk)
+
+        yield chunk
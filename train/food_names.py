@@ -0,0 +1,17 @@
+import re
+
+
+def normalize_food_name(food_name):
+    """
+    正規化食物名稱：轉小寫、移除標點符號、合併連續空白
+
+    用於預測快取與 USDA 資料表查詢的鍵值。
+
+    Args:
+        food_name (str): 食物名稱
+
+    Returns:
+        str: 正規化後的名稱
+    """
+    name = re.sub(r'[^\w\s]', ' ', food_name.casefold())
+    return ' '.join(name.split())
@@ -1,68 +1,84 @@
-from transformers import BertTokenizer, BertForSequenceClassification, BertConfig
+"""
+Train the BERT nutrition model
+
+Usage (from the project root):
+    python -m train.main --data usda/train.csv
+    python -m train.main --data usda/train.csv --num-workers 4 --threads 16 --batch-size 8 --grad-accum-steps 4
+
+The best model is saved as <output-dir>/model_bundle.pt (see train/bundle.py).
+"""
+from transformers import BertTokenizerFast
 import torch
-from dataset import FoodDataset
+from train.dataset import FoodDataset, LengthBucketSampler, dynamic_padding_collate, sequence_lengths
+from train.bundle import save_model_bundle
+from train.food_csv import NUTRIENT_COLUMNS, NUTRIENT_LABELS
+from train.predict import BertForNutrition
 from torch.utils.data import random_split
 import torch.nn as nn
+import argparse
 import os
 import numpy as np
 import time
 from tqdm import tqdm
 
-# Define data file path
-DATA_FILE = r"C:\Users\chard\Desktop\chicken\usda\train.csv"
-
-# Create necessary directories
-os.makedirs('results', exist_ok=True)
-
-# Custom BERT model for nutrition prediction
-class BertForNutrition(nn.Module):
-    def __init__(self, bert_model_name, num_nutrients=7):  # 更新為7個營養成分
-        super().__init__()
-        self.bert = BertForSequenceClassification.from_pretrained(
-            bert_model_name,
-            num_labels=num_nutrients,
-            problem_type="regression"
-        )
-        
-    def forward(self, input_ids, attention_mask):
-        outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
-        return outputs.logits
-
-# Use English BERT model
-model_name = "bert-base-uncased"  # Changed to English BERT
-tokenizer = BertTokenizer.from_pretrained(model_name)
-model = BertForNutrition(model_name)
-
-# Ensure the data file exists
-if not os.path.exists(DATA_FILE):
-    raise FileNotFoundError(f"Data file not found at: {DATA_FILE}")
+# Steps between host syncs for loss logging
+DEFAULT_LOG_EVERY = 50
 
-# Load dataset
-dataset = FoodDataset(DATA_FILE, tokenizer)
-scaler = dataset.get_scaler()  # Get the scaler for denormalization
+# Split into train and validation sets (seeded so the validation split can be rebuilt, e.g. by quantize.py)
+TRAIN_RATIO = 0.8
+SPLIT_SEED = 42
 
-# Split into train and validation sets
-train_size = int(0.8 * len(dataset))
-val_size = len(dataset) - train_size
-train_dataset, val_dataset = random_split(dataset, [train_size, val_size])
-
-print(f"Training set size: {train_size}")
-print(f"Validation set size: {val_size}")
+def make_loader(dataset, batch_size, shuffle=False, dynamic_padding=True, bucket_by_length=True, num_workers=0):
+    """
+    Build a DataLoader; with dynamic_padding each batch is padded to its longest
+    name instead of max_length, and bucket_by_length groups names of similar length.
+    Worker processes are kept alive between epochs and batches are pinned when
+    training on CUDA.
+    """
+    loader_args = {
+        'collate_fn': dynamic_padding_collate if dynamic_padding else None,
+        'num_workers': num_workers,
+        'pin_memory': torch.cuda.is_available(),
+        'persistent_workers': num_workers > 0
+    }
+    if bucket_by_length:
+        sampler = LengthBucketSampler(sequence_lengths(dataset), batch_size, shuffle=shuffle)
+        return torch.utils.data.DataLoader(dataset, batch_sampler=sampler, **loader_args)
+    return torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **loader_args)
 
 # Custom training loop
-def train_model(model, train_dataset, val_dataset, num_epochs=5, batch_size=8, learning_rate=2e-5):
+def train_model(model, train_dataset, val_dataset, num_epochs=5, batch_size=8, learning_rate=2e-5,
+                dynamic_padding=True, bucket_by_length=True, num_workers=0, grad_accum_steps=1,
+                save_best=None, bf16=False, gradient_checkpointing=False, log_every=DEFAULT_LOG_EVERY):
+    """
+    Args:
+        grad_accum_steps (int): Batches whose gradients are accumulated before each
+            optimizer step (effective batch size = batch_size * grad_accum_steps)
+        save_best (callable): Called with the model whenever the validation loss improves
+        bf16 (bool): Run forward passes under bfloat16 autocast (weights and optimizer stay fp32)
+        gradient_checkpointing (bool): Recompute BERT activations in the backward pass
+            instead of storing them, trading compute for memory
+        log_every (int): Steps between loss reads; the loss stays on the device in
+            between, so the host only waits for the device every log_every steps
+
+    Returns:
+        list[dict]: Per-epoch train/val loss, training seconds and tokens/sec
+    """
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
     
     model.to(device)
+    if gradient_checkpointing:
+        model.bert.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
     
-    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-    val_loader = torch.utils.data.DataLoader(val_dataset, batch_size=batch_size)
+    train_loader = make_loader(train_dataset, batch_size, True, dynamic_padding, bucket_by_length, num_workers)
+    val_loader = make_loader(val_dataset, batch_size, False, dynamic_padding, bucket_by_length, num_workers)
     
     optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
     criterion = nn.MSELoss()
     
     best_val_loss = float('inf')
+    history = []
     
     # Create progress bar for epochs
     epoch_pbar = tqdm(range(num_epochs), desc="Training Progress", position=0)
@@ -70,66 +86,98 @@ def train_model(model, train_dataset, val_dataset, num_epochs=5, batch_size=8, l
     for epoch in epoch_pbar:
         # Training phase
         model.train()
-        total_loss = 0
+        total_loss = torch.zeros((), device=device)
+        real_tokens = 0
+        padded_tokens = 0
+        epoch_start = time.time()
         
         # Create progress bar for batches
         train_pbar = tqdm(train_loader, desc=f"Epoch {epoch+1}/{num_epochs}", 
                          leave=False, position=1)
         
-        for batch in train_pbar:
-            input_ids = batch['input_ids'].to(device)
-            attention_mask = batch['attention_mask'].to(device)
-            nutrients = batch['nutrients'].to(device)
+        num_batches = len(train_loader)
+        optimizer.zero_grad()
+        for step, batch in enumerate(train_pbar, 1):
+            # Token counts come from the host copy of the mask, so they never wait for the device
+            real_tokens += int(batch['attention_mask'].sum())
+            padded_tokens += batch['attention_mask'].numel()
             
-            optimizer.zero_grad()
-            outputs = model(input_ids, attention_mask)
-            loss = criterion(outputs, nutrients)
-            loss.backward()
-            optimizer.step()
+            input_ids = batch['input_ids'].to(device, non_blocking=True)
+            attention_mask = batch['attention_mask'].to(device, non_blocking=True)
+            nutrients = batch['nutrients'].to(device, non_blocking=True)
+            
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+                outputs = model(input_ids, attention_mask)
+            loss = criterion(outputs.float(), nutrients)
+            # Average over the batches in this accumulation group; the last group of
+            # the epoch can be shorter than grad_accum_steps
+            group_start = (step - 1) // grad_accum_steps * grad_accum_steps
+            (loss / min(grad_accum_steps, num_batches - group_start)).backward()
+            
+            # Step once every grad_accum_steps batches (and on the last batch of the epoch)
+            if step % grad_accum_steps == 0 or step == num_batches:
+                optimizer.step()
+                optimizer.zero_grad()
             
-            total_loss += loss.item()
-            train_pbar.set_postfix({'loss': f'{loss.item():.4f}'})
+            total_loss += loss.detach()
+            if step % log_every == 0:
+                train_pbar.set_postfix({'loss': f'{loss.item():.4f}'})
         
-        avg_train_loss = total_loss / len(train_loader)
+        avg_train_loss = total_loss.item() / num_batches
+        train_time = time.time() - epoch_start
+        tqdm.write(f"Epoch {epoch+1}: {real_tokens / train_time:.0f} tokens/sec "
+                   f"({padded_tokens / train_time:.0f} incl. padding, {real_tokens / max(padded_tokens, 1):.0%} real tokens)")
         
         # Validation phase
         model.eval()
-        val_loss = 0
+        val_loss = torch.zeros((), device=device)
         val_pbar = tqdm(val_loader, desc="Validation", leave=False, position=1)
         
         with torch.no_grad():
-            for batch in val_pbar:
-                input_ids = batch['input_ids'].to(device)
-                attention_mask = batch['attention_mask'].to(device)
-                nutrients = batch['nutrients'].to(device)
+            for step, batch in enumerate(val_pbar, 1):
+                input_ids = batch['input_ids'].to(device, non_blocking=True)
+                attention_mask = batch['attention_mask'].to(device, non_blocking=True)
+                nutrients = batch['nutrients'].to(device, non_blocking=True)
                 
-                outputs = model(input_ids, attention_mask)
-                loss = criterion(outputs, nutrients)
-                val_loss += loss.item()
-                val_pbar.set_postfix({'loss': f'{loss.item():.4f}'})
+                with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+                    outputs = model(input_ids, attention_mask)
+                loss = criterion(outputs.float(), nutrients)
+                val_loss += loss
+                if step % log_every == 0:
+                    val_pbar.set_postfix({'loss': f'{loss.item():.4f}'})
         
-        avg_val_loss = val_loss / len(val_loader)
+        avg_val_loss = val_loss.item() / len(val_loader)
         epoch_pbar.set_postfix({
             'train_loss': f'{avg_train_loss:.4f}',
             'val_loss': f'{avg_val_loss:.4f}'
         })
         
+        history.append({
+            'epoch': epoch + 1,
+            'train_loss': avg_train_loss,
+            'val_loss': avg_val_loss,
+            'train_seconds': train_time,
+            'tokens_per_sec': real_tokens / train_time
+        })
+        
         # Save best model
         if avg_val_loss < best_val_loss:
             best_val_loss = avg_val_loss
-            torch.save(model.state_dict(), 'results/best_model.pth')
-            print("\nSaved new best model")
-
-# Train model
-train_model(model, train_dataset, val_dataset)
+            if save_best is not None:
+                save_best(model)
+                print("\nSaved new best model")
+    
+    if gradient_checkpointing:
+        model.bert.gradient_checkpointing_disable()
+    return history
 
 # Model evaluation
-def evaluate_model(model, dataset):
+def evaluate_model(model, dataset, batch_size=8, dynamic_padding=True, bucket_by_length=True, num_workers=0):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model.to(device)
     model.eval()
     
-    loader = torch.utils.data.DataLoader(dataset, batch_size=8)
+    loader = make_loader(dataset, batch_size, False, dynamic_padding, bucket_by_length, num_workers)
     criterion = nn.MSELoss(reduction='none')
     
     total_mse = 0
@@ -145,15 +193,12 @@ def evaluate_model(model, dataset):
     
     avg_mse = total_mse / len(loader)
     print("\nMean Squared Error per nutrient:")
-    nutrient_names = ['Sodium', 'Fat', 'Carbohydrate', 'Sugars', 'Fiber', 'Energy', 'Protein']
+    nutrient_names = [NUTRIENT_LABELS[col][0] for col in NUTRIENT_COLUMNS]
     for name, error in zip(nutrient_names, avg_mse.cpu().numpy()):
         print(f"{name}: {error:.4f}")
 
-# Evaluate model
-evaluate_model(model, val_dataset)
-
 # Function to predict nutrients for a new food item
-def predict_nutrients(model, tokenizer, food_name):
+def predict_nutrients(model, tokenizer, scaler, food_name):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model.to(device)
     model.eval()
@@ -180,13 +225,103 @@ def predict_nutrients(model, tokenizer, food_name):
     denormalized_predictions = predictions * scaler['std'] + scaler['mean']
     
     # Print predictions
-    nutrient_names = ['Sodium', 'Fat', 'Carbohydrate', 'Sugars', 'Fiber', 'Energy', 'Protein']
+    nutrient_names = [NUTRIENT_LABELS[col][0] for col in NUTRIENT_COLUMNS]
     print(f"\nPredicted nutrients for {food_name}:")
     for name, value in zip(nutrient_names, denormalized_predictions):
         print(f"{name}: {value:.2f}")
     
     return denormalized_predictions
 
-# Example usage
-print("\nExample predictions:")
-predict_nutrients(model, tokenizer, "apple")
+def parse_args():
+    parser = argparse.ArgumentParser(description='Train the BERT nutrition model')
+    parser.add_argument('--data', default='usda/train.csv', help='training CSV (USDA format)')
+    parser.add_argument('--bert-model', default='bert-base-uncased')
+    parser.add_argument('--output-dir', default='results')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--learning-rate', type=float, default=2e-5)
+    parser.add_argument('--grad-accum-steps', type=int, default=1,
+                        help='batches per optimizer step (effective batch size = batch-size * grad-accum-steps)')
+    parser.add_argument('--max-length', type=int, default=128)
+    parser.add_argument('--num-workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='DataLoader worker processes (0 loads batches in the main process)')
+    parser.add_argument('--threads', type=int, help='torch intra-op threads (default: torch default)')
+    parser.add_argument('--interop-threads', type=int, help='torch inter-op threads (default: torch default)')
+    parser.add_argument('--no-dynamic-padding', action='store_true', help='pad every batch to max-length')
+    parser.add_argument('--no-bucketing', action='store_true', help='do not group names of similar length')
+    parser.add_argument('--bf16', action='store_true', help='bfloat16 autocast for forward passes (CPU or CUDA)')
+    parser.add_argument('--gradient-checkpointing', action='store_true',
+                        help='recompute activations in backward to fit larger batches')
+    parser.add_argument('--log-every', type=int, default=DEFAULT_LOG_EVERY,
+                        help='steps between loss reads (each read waits for the device)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # Thread settings must be applied before any parallel work starts
+    if args.interop_threads:
+        torch.set_num_interop_threads(args.interop_threads)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(f"torch threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op")
+
+    # Ensure the data file exists
+    if not os.path.exists(args.data):
+        raise FileNotFoundError(f"Data file not found at: {args.data}")
+
+    # Create necessary directories
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Use English BERT model
+    tokenizer = BertTokenizerFast.from_pretrained(args.bert_model)
+    model = BertForNutrition(args.bert_model)
+
+    # Load dataset
+    dataset = FoodDataset(args.data, tokenizer, max_length=args.max_length)
+    scaler = dataset.get_scaler()  # Get the scaler for denormalization
+
+    train_size = int(TRAIN_RATIO * len(dataset))
+    val_size = len(dataset) - train_size
+    train_dataset, val_dataset = random_split(
+        dataset, [train_size, val_size],
+        generator=torch.Generator().manual_seed(SPLIT_SEED)
+    )
+
+    print(f"Training set size: {train_size}")
+    print(f"Validation set size: {val_size}")
+
+    def save_best(best_model):
+        # Save weights together with the scaler and tokenizer config so inference does not need train.csv
+        save_model_bundle(os.path.join(args.output_dir, 'model_bundle.pt'), best_model, scaler,
+                          dataset.nutrient_columns, tokenizer, dataset.max_length)
+
+    loader_options = {
+        'dynamic_padding': not args.no_dynamic_padding,
+        'bucket_by_length': not args.no_bucketing,
+        'num_workers': args.num_workers
+    }
+
+    # Train model
+    train_model(
+        model, train_dataset, val_dataset,
+        num_epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        grad_accum_steps=args.grad_accum_steps,
+        save_best=save_best,
+        bf16=args.bf16,
+        gradient_checkpointing=args.gradient_checkpointing,
+        log_every=args.log_every,
+        **loader_options
+    )
+
+    # Evaluate model
+    evaluate_model(model, val_dataset, batch_size=args.batch_size, **loader_options)
+
+    # Example usage
+    print("\nExample predictions:")
+    predict_nutrients(model, tokenizer, scaler, "apple")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import threading
+import time
+
+
+class ModelLoader:
+    """
+    延遲載入營養預測模型
+
+    train.predict 會匯入 torch 與 transformers，NutritionPredictor 初始化時還要載入
+    BERT 權重與訓練資料，因此改成第一次需要時（或由背景執行緒預熱時）才載入，
+    讓應用程式可以立即啟動。載入狀態與各階段耗時可透過 status() 查詢。
+    """
+
+    NOT_LOADED = 'not_loaded'
+    LOADING = 'loading'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = self.NOT_LOADED
+        self._error = None
+        self._predictor = None
+        self._timings = {}
+
+    def _load(self):
+        """在鎖內載入模型，已載入時直接回傳"""
+        with self._lock:
+            if self._predictor is not None:
+                return self._predictor
+
+            self._state = self.LOADING
+            self._error = None
+            started = time.perf_counter()
+            try:
+                import train.predict as predict_module
+                self._timings = {'import': time.perf_counter() - started}
+
+                predictor = predict_module.NutritionPredictor()
+                self._timings.update(predictor.load_timings)
+                self._timings['total'] = time.perf_counter() - started
+            except Exception as e:
+                self._state = self.FAILED
+                self._error = str(e)
+                raise
+
+            self._predictor = predictor
+            self._state = self.READY
+            return predictor
+
+    def get(self):
+        """取得 NutritionPredictor，必要時同步載入"""
+        if self._predictor is not None:
+            return self._predictor
+        return self._load()
+
+    def warm_up(self):
+        """
+        啟動背景執行緒預先載入模型
+
+        Returns:
+            threading.Thread: 預熱執行緒
+        """
+        def run():
+            try:
+                self._load()
+            except Exception as e:
+                print(f"Nutrition model warm-up failed: {e}")
+
+        thread = threading.Thread(target=run, name='nutrition-model-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def ready(self):
+        return self._state == self.READY
+
+    def status(self):
+        """
+        回傳模型載入狀態
+
+        Returns:
+            dict: state（not_loaded / loading / ready / failed）、錯誤訊息與各階段耗時（秒）
+        """
+        return {
+            'state': self._state,
+            'ready': self.ready,
+            'error': self._error,
+            'timings': dict(self._timings)
+        }
+
+    def predict_batch(self, food_names):
+        """批次預測，格式同 train.predict.predict_batch()"""
+        return self.get().predict_batch(food_names)
+
+    def cache_stats(self):
+        """回傳預測快取統計，模型尚未載入時回傳 None"""
+        if self._predictor is None:
+            return None
+        return self._predictor.cache.stats()
@@ -1,55 +1,180 @@
 import torch
 import torch.nn as nn
-from transformers import BertTokenizer, BertForSequenceClassification
-import pandas as pd
+from transformers import BertTokenizer, BertForSequenceClassification, BertConfig
 import numpy as np
 import os
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from train.food_names import normalize_food_name
+from train.dataset import fit_scaler_chunks
+from train.food_csv import NUTRIENT_COLUMNS, NUTRIENT_LABELS, CHUNK_SIZE, read_food_csv
+from train.bundle import load_model_bundle
+
+# 預測結果快取設定（可用環境變數覆寫）
+CACHE_SIZE = int(os.environ.get('NUTRITION_CACHE_SIZE', 10000))  # 記憶體 LRU 快取的最大筆數
+CACHE_PATH = os.environ.get('NUTRITION_CACHE_PATH')  # 設定後啟用 SQLite 永久快取
+
+# 推論後端：'eager'（fp32 HuggingFace 模型）或 'quantized'（train/quantize.py 匯出的 int8 TorchScript 模型）
+INFERENCE_BACKEND = os.environ.get('NUTRITION_BACKEND', 'eager')
+
+# 訓練時輸出的模型包（權重、標準化參數、tokenizer 設定），存在時優先使用；
+# 預設為在專案根目錄執行 python -m train.main 時的輸出位置（--output-dir 預設為 results）
+MODEL_BUNDLE_PATH = os.environ.get(
+    'NUTRITION_MODEL_BUNDLE',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'results', 'model_bundle.pt')
+)
 
 # 定義模型類別
 class BertForNutrition(nn.Module):
-    def __init__(self, bert_model_name, num_nutrients=7):
+    def __init__(self, bert_model_name=None, num_nutrients=7, config=None):
         super().__init__()
-        self.bert = BertForSequenceClassification.from_pretrained(
-            bert_model_name,
-            num_labels=num_nutrients,
-            problem_type="regression"
-        )
+        if config is not None:
+            # 依模型包中的設定建立結構，權重之後由 state_dict 載入，不需下載預訓練權重
+            self.bert = BertForSequenceClassification(config)
+        else:
+            self.bert = BertForSequenceClassification.from_pretrained(
+                bert_model_name,
+                num_labels=num_nutrients,
+                problem_type="regression"
+            )
         
     def forward(self, input_ids, attention_mask):
         outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
         return outputs.logits
 
+def quantized_model_path(model_path):
+    """回傳 fp32 模型檔對應的 int8 量化模型檔路徑（由 train/quantize.py 產生）"""
+    return os.path.splitext(model_path)[0] + '.int8.pt'
+
 # 定義數據處理類別
 class NutritionDataProcessor:
-    def __init__(self, data_file):
-        self.data = pd.read_csv(data_file)
-        self.nutrient_columns = [
-            'sodium_na', 'total_lipid_fat',
-            'carbohydrate_by_difference', 'total_sugars',
-            'fiber_total_dietary', 'energy', 'protein'
-        ]
+    def __init__(self, data_file, chunk_size=CHUNK_SIZE):
+        self.nutrient_columns = list(NUTRIENT_COLUMNS)
         
-        # 驗證數據列是否存在
-        missing_cols = [col for col in self.nutrient_columns if col not in self.data.columns]
-        if missing_cols:
-            raise ValueError(f"Missing columns in dataset: {missing_cols}")
-            
-        # 移除全為0的行
-        mask = (self.data[self.nutrient_columns] != 0).any(axis=1)
-        self.data = self.data[mask]
-        
-        # 移除缺失值
-        self.data = self.data.dropna(subset=self.nutrient_columns)
-        
-        # 計算標準化參數
-        self.scaler = self._calculate_scaling_params()
-        
-    def _calculate_scaling_params(self):
-        nutrients = self.data[self.nutrient_columns].values
-        mean = np.mean(nutrients, axis=0)
-        std = np.std(nutrients, axis=0)
-        std = np.where(std == 0, 1, std)  # 避免除以0
-        return {'mean': mean, 'std': std}
+        # 分段讀取 CSV，每段移除全為0的行與缺失值後累計標準化參數，不需整份檔案放進記憶體
+        self.scaler = fit_scaler_chunks(
+            read_food_csv(data_file, self.nutrient_columns, chunk_size),
+            self.nutrient_columns
+        )
+
+def model_version(path, bundle=None):
+    """
+    回傳模型的版本識別，用來判斷快取的預測結果是否屬於目前的模型
+
+    載入的是模型包且存有 model_id（儲存時產生）時直接使用；其他模型檔（舊格式 checkpoint、
+    int8 量化模型）以檔案大小與修改時間代替，不需讀取整個檔案計算雜湊值。
+
+    Args:
+        path (str): 實際載入的模型檔路徑
+        bundle (dict): 由 path 載入的模型包，None 表示不是模型包
+
+    Returns:
+        str: 模型版本識別
+    """
+    if bundle is not None and bundle.get('model_id'):
+        return bundle['model_id']
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+# 定義快取類別
+class PredictionCache:
+    """
+    預測結果快取：記憶體 LRU 加上可選的 SQLite 永久快取
+
+    每筆結果都綁定模型的版本識別（見 model_version），換了模型後舊的結果會自動失效。
+
+    Args:
+        model_hash (str): 模型的版本識別
+        max_size (int): 記憶體快取的最大筆數
+        db_path (str): SQLite 檔案路徑，None 表示只使用記憶體快取
+    """
+
+    def __init__(self, model_hash, max_size=CACHE_SIZE, db_path=None):
+        self.model_hash = model_hash
+        self.max_size = max_size
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS prediction_cache ('
+                'model_hash TEXT NOT NULL, food_key TEXT NOT NULL, result TEXT NOT NULL, '
+                'PRIMARY KEY (model_hash, food_key))'
+            )
+            # 清除其他模型版本留下的結果
+            self._conn.execute('DELETE FROM prediction_cache WHERE model_hash != ?', (model_hash,))
+            self._conn.commit()
+
+    def get(self, key):
+        """取得快取結果，不存在時回傳 None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT result FROM prediction_cache WHERE model_hash = ? AND food_key = ?',
+                    (self.model_hash, key)
+                ).fetchone()
+                if row:
+                    self.disk_hits += 1
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put_many(self, items):
+        """寫入多筆 (key, result)"""
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value)
+            if self._conn is not None:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO prediction_cache (model_hash, food_key, result) VALUES (?, ?, ?)',
+                    [(self.model_hash, key, json.dumps(value)) for key, value in items]
+                )
+                self._conn.commit()
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清除所有快取（包含永久快取）"""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM prediction_cache')
+                self._conn.commit()
+
+    def stats(self):
+        """回傳快取命中統計"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'persistent': self._conn is not None,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0
+            }
 
 # 定義預測類別
 class NutritionPredictor:
@@ -65,52 +190,93 @@ class NutritionPredictor:
         if NutritionPredictor._initialized:
             return
             
+        self.bundle_path = MODEL_BUNDLE_PATH
+        # 沒有模型包時使用舊格式：只有權重的 checkpoint，再從訓練 CSV 計算標準化參數
         self.model_path = r'C:\Users\chard\Desktop\chicken\best_model.pth'
         self.data_file = r"C:\Users\chard\Desktop\chicken\usda\train.csv"
         
+        use_bundle = os.path.exists(self.bundle_path)
+        if use_bundle:
+            self.model_path = self.bundle_path
+        
+        self.backend = INFERENCE_BACKEND
+        if self.backend == 'quantized':
+            self.model_path = quantized_model_path(self.model_path)
+        elif self.backend != 'eager':
+            raise ValueError(f"Unknown inference backend: {self.backend}")
+        
         # 檢查文件
         if not os.path.exists(self.model_path):
             raise FileNotFoundError(f"Model file not found: {self.model_path}")
-        if not os.path.exists(self.data_file):
+        if not use_bundle and not os.path.exists(self.data_file):
             raise FileNotFoundError(f"Data file not found: {self.data_file}")
             
-        # 設置設備
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # 各載入階段耗時（秒）
+        self.load_timings = {}
+        started = time.perf_counter()
+        
+        # 載入模型包（權重以 mmap 方式延後讀取）
+        bundle = None
+        tokenizer_name, tokenizer_kwargs = 'bert-base-uncased', {}
+        self.max_length = 128
+        if use_bundle:
+            bundle = load_model_bundle(self.bundle_path)
+            tokenizer_name = bundle['tokenizer']['name_or_path']
+            tokenizer_kwargs = {'do_lower_case': bundle['tokenizer']['do_lower_case']}
+            self.max_length = bundle['tokenizer']['max_length']
+            self.load_timings['bundle'] = time.perf_counter() - started
+            started = time.perf_counter()
         
         # 載入模型和tokenizer
-        self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-        self.model = BertForNutrition('bert-base-uncased')
-        self.model.load_state_dict(torch.load(self.model_path))
-        self.model.to(self.device)
+        self.tokenizer = BertTokenizer.from_pretrained(tokenizer_name, **tokenizer_kwargs)
+        self.load_timings['tokenizer'] = time.perf_counter() - started
+        started = time.perf_counter()
+        if self.backend == 'quantized':
+            # int8 動態量化模型只支援 CPU
+            self.device = torch.device("cpu")
+            self.model = torch.jit.load(self.model_path, map_location=self.device)
+        else:
+            # 設置設備
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            if bundle is not None:
+                self.model = BertForNutrition(config=BertConfig.from_dict(bundle['bert_config']))
+                self.model.load_state_dict(bundle['state_dict'])
+            else:
+                self.model = BertForNutrition('bert-base-uncased')
+                self.model.load_state_dict(torch.load(self.model_path))
+            self.model.to(self.device)
         self.model.eval()
+        self.load_timings['weights'] = time.perf_counter() - started
+        started = time.perf_counter()
         
-        # 載入數據和計算標準化參數
-        data = pd.read_csv(self.data_file)
-        self.nutrient_columns = [
-            'sodium_na', 'total_lipid_fat',
-            'carbohydrate_by_difference', 'total_sugars',
-            'fiber_total_dietary', 'energy', 'protein'
-        ]
-        
-        nutrients = data[self.nutrient_columns].values
-        self.mean = np.mean(nutrients, axis=0)
-        self.std = np.std(nutrients, axis=0)
-        self.std = np.where(self.std == 0, 1, self.std)
+        # 標準化參數：模型包中已存有訓練時的值，舊格式才需要讀取整份 CSV
+        if bundle is not None:
+            self.nutrient_columns = bundle['nutrient_columns']
+            self.mean = bundle['scaler']['mean']
+            self.std = bundle['scaler']['std']
+        else:
+            self.nutrient_columns = list(NUTRIENT_COLUMNS)
+            
+            # 與舊版相同，以未過濾的整份資料計算（分段讀取）
+            scaler = fit_scaler_chunks(
+                read_food_csv(self.data_file, self.nutrient_columns, drop_zero_rows=False, drop_missing=False),
+                self.nutrient_columns
+            )
+            self.mean = scaler['mean']
+            self.std = scaler['std']
+            self.load_timings['csv_stats'] = time.perf_counter() - started
         
-        self.nutrient_names = [
-            'Sodium', 'Fat', 'Carbohydrate', 
-            'Sugars', 'Fiber', 'Energy', 'Protein'
-        ]
+        # 結果的營養素名稱與單位，順序同模型輸出的欄位
+        self.nutrient_names = [NUTRIENT_LABELS[col][0] for col in self.nutrient_columns]
+        self.units = dict(NUTRIENT_LABELS[col] for col in self.nutrient_columns)
         
-        self.units = {
-            'Sodium': 'mg',
-            'Fat': 'g',
-            'Carbohydrate': 'g',
-            'Sugars': 'g',
-            'Fiber': 'g',
-            'Energy': 'kcal',
-            'Protein': 'g'
-        }
+        # 預測結果快取，綁定目前模型的版本識別（量化模型是另一個檔案，不沿用模型包的 model_id）
+        started = time.perf_counter()
+        self.cache = PredictionCache(
+            model_version(self.model_path, bundle if self.model_path == self.bundle_path else None),
+            CACHE_SIZE, CACHE_PATH
+        )
+        self.load_timings['cache'] = time.perf_counter() - started
         
         NutritionPredictor._initialized = True
     
@@ -128,41 +294,81 @@ class NutritionPredictor:
                     ...
                 }
         """
-        # Tokenize
-        encoding = self.tokenizer(
-            food_name,
-            add_special_tokens=True,
-            max_length=128,
-            padding='max_length',
-            truncation=True,
-            return_tensors='pt'
-        )
-        
-        # 移動到正確的設備
-        input_ids = encoding['input_ids'].to(self.device)
-        attention_mask = encoding['attention_mask'].to(self.device)
-        
-        # 預測
-        with torch.no_grad():
-            outputs = self.model(input_ids, attention_mask)
-        
-        # 反標準化
-        predictions = outputs.cpu().numpy()[0]
-        denormalized = predictions * self.std + self.mean
-        
-        # 確保所有值非負
-        denormalized = np.maximum(denormalized, 0)
-        
-        # 創建結果字典
-        results = {}
-        for name, value in zip(self.nutrient_names, denormalized):
-            results[name] = {
-                'value': float(value),
-                'unit': self.units[name]
-            }
-        
+        return self.predict_batch([food_name])[0]
+
+    def predict_batch(self, food_names, batch_size=None):
+        """
+        批次預測多個食物的營養成分
+
+        每個批次只補齊到該批次中最長的名稱，而不是固定補到 128 個 token。
+
+        Args:
+            food_names (list[str]): 食物名稱清單（英文）
+            batch_size (int): 每次送進模型的名稱數量；None 時全部名稱一次前向傳播
+                （呼叫端已限制名稱數，例如 MicroBatcher 的 max_batch_size 與 /predict_nutrition_batch 的上限）
+
+        Returns:
+            list[dict]: 與 food_names 順序相同的預測結果，格式同 predict()
+        """
+        keys = [normalize_food_name(name) for name in food_names]
+
+        # 正規化後的名稱只用來查快取與去除重複，送進模型的是每個名稱第一次出現時的原始寫法
+        originals = {}
+        for key, name in zip(keys, food_names):
+            originals.setdefault(key, name)
+
+        # 先查快取，只有未命中的名稱（去除重複）才送進模型
+        cached = {}
+        for key in originals:
+            value = self.cache.get(key)
+            if value is not None:
+                cached[key] = value
+        missing = [key for key in originals if key not in cached]
+
+        predicted = self._predict_uncached([originals[key] for key in missing], batch_size)
+        self.cache.put_many(list(zip(missing, predicted)))
+        cached.update(zip(missing, predicted))
+
+        return [cached[key] for key in keys]
+
+    def _predict_uncached(self, food_names, batch_size):
+        """直接以模型預測，不經過快取"""
+        results = []
+        batch_size = batch_size or max(len(food_names), 1)
+        for start in range(0, len(food_names), batch_size):
+            batch = list(food_names[start:start + batch_size])
+
+            # Tokenize（動態補齊到批次內最長的序列）
+            encoding = self.tokenizer(
+                batch,
+                add_special_tokens=True,
+                max_length=self.max_length,
+                padding='longest',
+                truncation=True,
+                return_tensors='pt'
+            )
+
+            # 移動到正確的設備
+            input_ids = encoding['input_ids'].to(self.device)
+            attention_mask = encoding['attention_mask'].to(self.device)
+
+            # 預測
+            with torch.no_grad():
+                outputs = self.model(input_ids, attention_mask)
+
+            # 反標準化並確保所有值非負
+            denormalized = np.maximum(outputs.cpu().numpy() * self.std + self.mean, 0)
+            results.extend(self._to_result(row) for row in denormalized)
+
         return results
 
+    def _to_result(self, values):
+        """將一列反標準化後的數值轉成結果字典"""
+        return {
+            name: {'value': float(value), 'unit': self.units[name]}
+            for name, value in zip(self.nutrient_names, values)
+        }
+
 def predict(food_name):
     """
     快速預測函數
@@ -181,6 +387,31 @@ def predict(food_name):
     predictor = NutritionPredictor()
     return predictor.predict(food_name)
 
+def predict_batch(food_names, batch_size=32):
+    """
+    批次預測函數
+
+    Args:
+        food_names (list[str]): 食物名稱清單（英文），數量不限
+        batch_size (int): 每次送進模型的名稱數量
+
+    Returns:
+        list[dict]: 每個名稱的營養成分預測結果，格式同 predict()
+    """
+    predictor = NutritionPredictor()
+    return predictor.predict_batch(food_names, batch_size=batch_size)
+
+def cache_stats():
+    """
+    回傳預測快取的命中統計
+
+    Returns:
+        dict: 快取統計，模型尚未載入時回傳 None
+    """
+    if not NutritionPredictor._initialized:
+        return None
+    return NutritionPredictor().cache.stats()
+
 def print_prediction(food_name):
     """
     打印格式化的預測結果
@@ -0,0 +1,136 @@
+"""
+將訓練好的 BertForNutrition 匯出為 int8 動態量化的 TorchScript 模型，供 CPU 推論使用
+
+用法（在專案根目錄執行）：
+    python -m train.quantize --model model_bundle.pt --data usda/train.csv
+
+--model 可以是模型包（train/bundle.py）或舊格式的 best_model.pth。
+會輸出 <model>.int8.pt（例如 model_bundle.int8.pt），並在驗證集上比較量化模型與 fp32 模型的預測差異。
+設定環境變數 NUTRITION_BACKEND=quantized 後，NutritionPredictor 會改用量化模型。
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, random_split
+from transformers import BertTokenizerFast, BertConfig
+
+from train.dataset import FoodDataset
+from train.food_csv import NUTRIENT_LABELS
+from train.main import TRAIN_RATIO, SPLIT_SEED
+from train.predict import BertForNutrition, quantized_model_path
+
+
+def quantize_model(model):
+    """將模型中的 Linear 層做 int8 動態量化"""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(model, tokenizer, output_path):
+    """
+    以 TorchScript trace 匯出模型
+
+    Args:
+        model (nn.Module): 要匯出的模型（需已是 eval 模式）
+        tokenizer: BERT tokenizer，用來產生範例輸入
+        output_path (str): 輸出檔案路徑
+
+    Returns:
+        torch.jit.ScriptModule: 匯出的模型
+    """
+    example = tokenizer(
+        ['grilled chicken breast', 'apple'],
+        padding='longest',
+        return_tensors='pt'
+    )
+    with torch.no_grad():
+        traced = torch.jit.trace(model, (example['input_ids'], example['attention_mask']), strict=False)
+    traced.save(output_path)
+    return traced
+
+
+def parity_check(reference, candidate, loader, scaler, nutrient_columns):
+    """
+    比較兩個模型在同一批資料上的預測差異（反標準化後的原始單位）
+
+    Args:
+        reference (nn.Module): 基準模型（fp32）
+        candidate (nn.Module): 比較的模型（量化）
+        loader (DataLoader): 驗證資料
+        scaler (dict): 包含 'mean' 與 'std' 的標準化參數
+        nutrient_columns (list[str]): 模型輸出對應的營養素欄位順序
+
+    Returns:
+        dict: 每個營養素的最大絕對誤差與平均絕對誤差
+    """
+    names = [NUTRIENT_LABELS.get(column, (column,))[0] for column in nutrient_columns]
+    max_dev = np.zeros(len(names))
+    total_dev = np.zeros(len(names))
+    count = 0
+
+    with torch.no_grad():
+        for batch in loader:
+            input_ids = batch['input_ids']
+            attention_mask = batch['attention_mask']
+            expected = reference(input_ids, attention_mask).numpy() * scaler['std']
+            actual = candidate(input_ids, attention_mask).numpy() * scaler['std']
+            deviation = np.abs(expected - actual)
+            max_dev = np.maximum(max_dev, deviation.max(axis=0))
+            total_dev += deviation.sum(axis=0)
+            count += len(deviation)
+
+    return {
+        name: {'max_abs_dev': float(max_value), 'mean_abs_dev': float(total_value / max(count, 1))}
+        for name, max_value, total_value in zip(names, max_dev, total_dev)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export an int8 quantized TorchScript nutrition model')
+    parser.add_argument('--model', required=True, help='fp32 model bundle or best_model.pth checkpoint')
+    parser.add_argument('--data', required=True, help='training CSV used to rebuild the validation split')
+    parser.add_argument('--bert-model', default='bert-base-uncased')
+    parser.add_argument('--output', help='output path (default: <model>.int8.pt)')
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    output_path = args.output or quantized_model_path(args.model)
+    torch.set_grad_enabled(False)
+
+    tokenizer = BertTokenizerFast.from_pretrained(args.bert_model)
+    checkpoint = torch.load(args.model, map_location='cpu', weights_only=True)
+    if 'format_version' in checkpoint:
+        # 模型包（train/bundle.py）
+        model = BertForNutrition(config=BertConfig.from_dict(checkpoint['bert_config']))
+        model.load_state_dict(checkpoint['state_dict'])
+    else:
+        model = BertForNutrition(args.bert_model)
+        model.load_state_dict(checkpoint)
+    model.eval()
+
+    quantized = quantize_model(model)
+    traced = export_torchscript(quantized, tokenizer, output_path)
+    print(f"Saved quantized model to {output_path}")
+    print(f"Size: {os.path.getsize(args.model) / 1e6:.1f} MB -> {os.path.getsize(output_path) / 1e6:.1f} MB")
+
+    # 以與 train/main.py 相同的比例與種子重建訓練時的驗證集
+    dataset = FoodDataset(args.data, tokenizer)
+    train_size = int(TRAIN_RATIO * len(dataset))
+    _, val_dataset = random_split(
+        dataset, [train_size, len(dataset) - train_size],
+        generator=torch.Generator().manual_seed(SPLIT_SEED)
+    )
+    loader = DataLoader(val_dataset, batch_size=args.batch_size)
+
+    # 模型包記錄了模型輸出的營養素順序；舊格式的 checkpoint 沿用資料集的欄位順序
+    nutrient_columns = checkpoint.get('nutrient_columns', dataset.nutrient_columns)
+    report = parity_check(model, traced, loader, dataset.get_scaler(), nutrient_columns)
+    print("\nMax / mean absolute deviation per nutrient (int8 vs fp32):")
+    for name, values in report.items():
+        print(f"{name:<15} {values['max_abs_dev']:>10.4f} {values['mean_abs_dev']:>10.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import Counter
+
+import pandas as pd
+
+from train.food_csv import NUTRIENT_COLUMNS, NUTRIENT_LABELS
+from train.food_names import normalize_food_name
+
+# 預設查詢的 USDA 資料表
+USDA_TABLES = [
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'usda', 'csv', name)
+    for name in ('train3.csv', 'train4.csv')
+]
+
+# 模糊比對的最低相似度（字元 trigram 的 Dice 係數）
+FUZZY_THRESHOLD = 0.85
+
+
+def _trigrams(name):
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class UsdaLookup:
+    """
+    USDA 營養資料表查詢
+
+    依序以原始名稱、正規化名稱做雜湊查詢，再以字元 trigram 反向索引做模糊比對，
+    只有查不到的名稱才需要交給模型預測。
+
+    Args:
+        table_paths (list[str]): USDA CSV 檔案路徑，第一欄為食物名稱
+        fuzzy_threshold (float): 模糊比對的最低相似度，None 表示停用模糊比對
+    """
+
+    def __init__(self, table_paths=None, fuzzy_threshold=FUZZY_THRESHOLD):
+        self.table_paths = table_paths or USDA_TABLES
+        self.fuzzy_threshold = fuzzy_threshold
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+
+            names = []
+            values = []
+            exact = {}
+            normalized = {}
+            for path in self.table_paths:
+                if not os.path.exists(path):
+                    continue
+                df = pd.read_csv(path)
+                name_column = df.columns[0]
+                df = df.dropna(subset=[name_column] + list(NUTRIENT_COLUMNS))
+
+                for name, row in zip(df[name_column].astype(str), df[list(NUTRIENT_COLUMNS)].itertuples(index=False)):
+                    key = normalize_food_name(name)
+                    if not key or key in normalized:
+                        continue
+                    index = len(names)
+                    names.append(name)
+                    values.append(tuple(float(v) for v in row))
+                    exact.setdefault(name.strip(), index)
+                    normalized[key] = index
+
+            # 字元 trigram 反向索引：trigram -> 名稱索引清單
+            trigram_index = {}
+            trigram_counts = [0] * len(names)
+            for key, index in normalized.items():
+                grams = _trigrams(key)
+                trigram_counts[index] = len(grams)
+                for gram in grams:
+                    trigram_index.setdefault(gram, []).append(index)
+
+            self._names = names
+            self._values = values
+            self._exact = exact
+            self._normalized = normalized
+            self._trigram_index = trigram_index
+            self._trigram_counts = trigram_counts
+            self._loaded = True
+
+    def __len__(self):
+        self._load()
+        return len(self._names)
+
+    def _fuzzy_match(self, key):
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigram_index.get(gram, ()))
+        if not shared:
+            return None, 0.0
+
+        best_index, best_score = None, 0.0
+        for index, count in shared.items():
+            score = 2 * count / (len(grams) + self._trigram_counts[index])
+            if score > best_score:
+                best_index, best_score = index, score
+        return best_index, best_score
+
+    def lookup(self, food_name):
+        """
+        查詢食物名稱的營養成分
+
+        Args:
+            food_name (str): 食物名稱（英文）
+
+        Returns:
+            dict: 查到時回傳
+                {
+                    'nutrition': 與 predict() 相同格式的營養成分,
+                    'matched_name': 資料表中的名稱,
+                    'match': 'exact'、'normalized' 或 'fuzzy',
+                    'similarity': 相似度（0~1）
+                }
+                查不到時回傳 None
+        """
+        self._load()
+
+        index = self._exact.get(food_name.strip())
+        match, similarity = 'exact', 1.0
+        if index is None:
+            key = normalize_food_name(food_name)
+            index = self._normalized.get(key)
+            match = 'normalized'
+            if index is None and self.fuzzy_threshold is not None and key:
+                index, similarity = self._fuzzy_match(key)
+                match = 'fuzzy'
+                if similarity < self.fuzzy_threshold:
+                    return None
+        if index is None:
+            return None
+
+        nutrition = {
+            name: {'value': value, 'unit': unit}
+            for (name, unit), value in zip((NUTRIENT_LABELS[col] for col in NUTRIENT_COLUMNS), self._values[index])
+        }
+        return {
+            'nutrition': nutrition,
+            'matched_name': self._names[index],
+            'match': match,
+            'similarity': similarity
+        }
@@ -1,22 +1,27 @@
-import pandas as pd
-
-def delete_columns(input_file, output_file):
-    # Read the CSV file
-    df = pd.read_csv(input_file)
-    
-    # Drop the first and third columns
-    df = df.drop([df.columns[2]], axis=1)
-    
-    # Save the modified DataFrame to a new CSV file
-    df.to_csv(output_file, index=False)
-
-if __name__ == "__main__":
-    # Example usage
-    input_file = r"usda\usda_food_data_filtered.csv"  # Replace with your input CSV file name
-    output_file = "usda/train.csv"  # Replace with your desired output CSV file name
-    
-    try:
-        delete_columns(input_file, output_file)
-        print(f"Successfully deleted columns. Result saved to {output_file}")
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
+import pandas as pd
+
+from train.food_csv import CHUNK_SIZE
+
+def delete_columns(input_file, output_file, chunk_size=CHUNK_SIZE):
+    # Stream the CSV file in chunks so large FDC exports never have to fit in memory.
+    # Columns keep pandas' default dtypes (float64), so values are written back unchanged
+    # and files without the nutrient columns work as before
+    first = True
+    for chunk in pd.read_csv(input_file, chunksize=chunk_size):
+        # Drop the third column
+        chunk = chunk.drop([chunk.columns[2]], axis=1)
+        
+        # Append the modified chunk to the output CSV file
+        chunk.to_csv(output_file, index=False, mode='w' if first else 'a', header=first)
+        first = False
+
+if __name__ == "__main__":
+    # Example usage (run from the project root: python -m usda.delet_blank)
+    input_file = r"usda\usda_food_data_filtered.csv"  # Replace with your input CSV file name
+    output_file = "usda/train.csv"  # Replace with your desired output CSV file name
+    
+    try:
+        delete_columns(input_file, output_file)
+        print(f"Successfully deleted columns. Result saved to {output_file}")
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
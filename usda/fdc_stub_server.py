@@ -0,0 +1,94 @@
+"""
+本機的 FoodData Central 測試伺服器，用來在不消耗 API 配額的情況下測試 usda_download.py
+
+支援 POST /v1/foods（批次查詢），回傳的營養素數值由 ID 決定。
+ID 為 7 的倍數時視為查無資料（不出現在回傳結果中），
+並可用 --fail-rate 模擬 429 回應以測試重試。
+
+用法（在專案根目錄執行）：
+    python usda/fdc_stub_server.py --port 8765
+    python usda/usda_download.py --base-url http://127.0.0.1:8765/v1 --rate-per-hour 0
+"""
+import argparse
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NUTRIENTS = [
+    ("Water", "g"),
+    ("Energy", "kcal"),
+    ("Protein", "g"),
+    ("Total lipid (fat)", "g"),
+    ("Carbohydrate, by difference", "g"),
+    ("Fiber, total dietary", "g"),
+    ("Total Sugars", "g"),
+    ("Sodium, Na", "mg")
+]
+
+
+def fake_food(fdc_id):
+    """依 ID 產生固定的假資料"""
+    rng = random.Random(fdc_id)
+    return {
+        "fdcId": fdc_id,
+        "description": f"Stub food {fdc_id}",
+        "foodNutrients": [
+            {"nutrient": {"name": name, "unitName": unit}, "amount": round(rng.uniform(0, 100), 2)}
+            for name, unit in NUTRIENTS
+        ]
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+    request_count = 0
+    lock = threading.Lock()
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        with StubHandler.lock:
+            StubHandler.request_count += 1
+
+        if not self.path.split("?")[0].endswith("/foods"):
+            self._send_json(404, {"error": "not found"})
+            return
+        if random.random() < self.fail_rate:
+            self._send_json(429, {"error": "rate limited"}, {"Retry-After": "1"})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        foods = [fake_food(fdc_id) for fdc_id in body.get("fdcIds", []) if fdc_id % 7 != 0]
+        self._send_json(200, foods)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local FoodData Central stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    StubHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"FDC stub server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,46 @@
-import requests
-import pandas as pd
-import time
+"""
+從 USDA FoodData Central 下載 demand.txt 中食物 ID 的營養資料
+
+使用 /foods 批次端點一次查詢多個 ID，以多執行緒同時送出請求，並用 token bucket
+把請求速率控制在 API 配額內（預設每小時 1000 次）。遇到 429 或 5xx 時會依
+Retry-After 或指數退避重試。
+
+用法（在專案根目錄執行）：
+    python usda/usda_download.py
+    python usda/usda_download.py --base-url http://127.0.0.1:8765/v1 --rate-per-hour 0
+
+--base-url 可以指向本機的測試伺服器（usda/fdc_stub_server.py），--rate-per-hour 0 表示不限速。
+結果以附加方式寫入 CSV，已處理的 ID 記錄在 usda/download_journal.txt，demand.txt 不會被修改；
+中斷後重新執行即可從上次的進度繼續。
+"""
+import argparse
+import csv
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-API_KEY = "FYHVhBIADmddIvqRTQDJfVlW3CXtWraCOZ70pcLQ"
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+API_KEY = os.environ.get("FDC_API_KEY", "FYHVhBIADmddIvqRTQDJfVlW3CXtWraCOZ70pcLQ")
+BASE_URL = "https://api.nal.usda.gov/fdc/v1"
 CSV_FILE = "usda/usda_food_data_filtered.csv"
-t1 = time.time()
-# 讀取需要查詢的食物ID
-file_path = "usda/demand.txt"
-with open(file_path, "r", encoding="utf-8") as f:
-    food_ids = [line.strip() for line in f]
+DEMAND_FILE = "usda/demand.txt"
+# 進度日誌：記錄已處理（取得或查無）的 ID，中斷後可從上次的進度繼續
+JOURNAL_FILE = "usda/download_journal.txt"
 
-url_template = "https://api.nal.usda.gov/fdc/v1/food/{food_id}?api_key={api_key}"
+# FDC API 的預設配額為每個 key 每小時 1000 次請求
+RATE_PER_HOUR = 1000
+# /foods 端點每次最多 20 個 ID
+BATCH_SIZE = 20
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+REQUEST_TIMEOUT = 30
+# 累積多少筆結果後寫入檔案
+FLUSH_EVERY = 200
 
 # 定義主要營養素
 main_nutrients = {
@@ -25,102 +54,283 @@ main_nutrients = {
     "Sodium, Na": "sodium_na"
 }
 
-# 讀取現有的CSV文件（如果存在）
-if os.path.exists(CSV_FILE):
-    df = pd.read_csv(CSV_FILE)
-    print(f"已載入現有CSV文件，目前有 {len(df)} 筆資料")
-else:
-    df = pd.DataFrame(columns=["food_id", "食物名稱"] + list(main_nutrients.values()))
-    print("創建新的CSV文件")
-
-# 從現有數據中獲取已處理的食物ID
-fetched_foods = set(df['food_id'].astype(str).values) if 'food_id' in df.columns else set()
-print(f"已有 {len(fetched_foods)} 個食物ID記錄")
-
-def save_to_csv(food_data, food_id):
-    """將新的食物數據添加到CSV文件"""
-    global df
-    # 添加food_id到數據中
-    food_data['food_id'] = food_id
-    
-    # 創建新的一行數據
-    new_row = pd.DataFrame([food_data])
-    
-    # 添加到現有DataFrame
-    df = pd.concat([df, new_row], ignore_index=True)
-    
-    # 重新排列列的順序，確保food_id在最前面
-    columns = ['food_id', '食物名稱'] + list(main_nutrients.values())
-    df = df[columns]
-    
-    # 保存整個DataFrame
-    df.to_csv(CSV_FILE, index=False)
-    print(f"已將 {food_data['食物名稱']} (ID: {food_id}) 添加到CSV文件，目前共 {len(df)} 筆資料")
-
-def get_food_data(food_id):
-    """獲取單個食物的營養數據"""
-    # 首先檢查food_id是否已存在
-    if str(food_id) in fetched_foods:
-        print(f"食物 ID {food_id} 已存在於CSV中，跳過API請求...")
-        return None
-        
-    try:
-        # 獲取 USDA 食品數據
-        url = url_template.format(food_id=food_id, api_key=API_KEY)
-        response = requests.get(url)
-        data = response.json()
-
-        time.sleep(2.75)  # API 請求間隔
-        if "foodNutrients" not in data:
-            print(f"食物 ID {food_id} 獲取失敗！")
-            return None
-
-        # 提取主要營養素
-        food_data = {"食物名稱": data["description"]}
-        for key in main_nutrients.values():
-            food_data[key] = None  # 預先填充為空值
-
-        for nutrient in data["foodNutrients"]:
-            nutrient_name = nutrient["nutrient"]["name"]
-            if nutrient_name in main_nutrients:
-                food_data[main_nutrients[nutrient_name]] = nutrient["amount"]
-
-        # 如果有空值，使用0填充
-        for key in main_nutrients.values():
-            if food_data[key] is None:
-                food_data[key] = 0
-                
-
-        return food_data
-
-    except Exception as e:
-        print(f"處理食物 ID {food_id} 時發生錯誤: {str(e)}")
+COLUMNS = ["food_id", "食物名稱"] + list(main_nutrients.values())
+
+# 需要重試的 HTTP 狀態碼
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket 限速器（執行緒安全）
+
+    Args:
+        rate (float): 每秒補充的 token 數，0 表示不限速
+        capacity (float): 最多可累積的 token 數（允許的瞬間請求數）
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個 token，不足時等待"""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class FdcClient:
+    """
+    FoodData Central API 客戶端
+
+    每個執行緒使用自己的 requests.Session（共用連線池設定），請求前先向限速器取得 token。
+
+    Args:
+        api_key (str): FDC API key
+        base_url (str): API 根網址，可指向本機的測試伺服器
+        rate_per_hour (float): 每小時請求上限，0 表示不限速
+        pool_size (int): 每個 Session 的連線池大小
+        max_retries (int): 失敗時的最大重試次數
+    """
+
+    def __init__(self, api_key=API_KEY, base_url=BASE_URL, rate_per_hour=RATE_PER_HOUR,
+                 pool_size=MAX_WORKERS, max_retries=MAX_RETRIES):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.limiter = TokenBucket(rate_per_hour / 3600, capacity=1)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def _post(self, path, payload):
+        """送出 POST 請求，遇到 429/5xx 或連線錯誤時退避重試"""
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            retry_after = None
+            try:
+                response = self.session.post(
+                    url, params={"api_key": self.api_key}, json=payload, timeout=REQUEST_TIMEOUT
+                )
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                retry_after = response.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+            if retry_after is not None and retry_after.isdigit():
+                delay = int(retry_after)
+            else:
+                delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+            print(f"請求失敗（{error}），{delay:.1f} 秒後重試")
+            time.sleep(delay)
+
+    def get_foods(self, food_ids):
+        """
+        以 /foods 批次端點查詢多個食物
+
+        Args:
+            food_ids (list[str]): 食物 ID（最多 BATCH_SIZE 個）
+
+        Returns:
+            dict: food_id -> 營養資料，API 沒有回傳的 ID 不會出現在結果中
+        """
+        data = self._post("/foods", {"fdcIds": [int(fid) for fid in food_ids], "format": "full"})
+        results = {}
+        for food in data:
+            food_data = parse_food(food)
+            if food_data is not None:
+                results[str(food["fdcId"])] = food_data
+        return results
+
+
+def parse_food(food):
+    """從 API 回傳的食物資料中取出主要營養素，缺少的營養素以 0 填充"""
+    if "foodNutrients" not in food:
         return None
 
-def main(t1):
-    # 轉成可變動的 list
-    remaining_foods = list(food_ids)
-    for food_id in food_ids:
-        food_data = get_food_data(food_id)
-        print(round(time.time()-t1, 3),time.ctime(), end=" ")
-        t1 = time.time()
-        # 不論成功或失敗都要移除
-        remaining_foods.remove(food_id)
-        with open(file_path, "w", encoding="utf-8") as f:
-            for fid in remaining_foods:
-                f.write(f"{fid}\n")
+    food_data = {"食物名稱": food["description"]}
+    for key in main_nutrients.values():
+        food_data[key] = 0
+
+    for nutrient in food["foodNutrients"]:
+        nutrient_name = nutrient.get("nutrient", {}).get("name")
+        if nutrient_name in main_nutrients and nutrient.get("amount") is not None:
+            food_data[main_nutrients[nutrient_name]] = nutrient["amount"]
+
+    return food_data
+
+
+class CheckpointWriter:
+    """
+    以附加方式寫入下載結果，並記錄已處理的 ID
+
+    結果先暫存在記憶體，累積 flush_every 筆後一次附加到 CSV，再把這些 ID
+    附加到進度日誌（每行「ID<TAB>狀態」），因此每筆資料的寫入成本固定，不會
+    隨資料量增加。CSV 先寫入，日誌後寫入，中斷後重新執行時以兩者的聯集判斷
+    已處理的 ID，不會重複下載，也不會重複寫入。
+
+    Args:
+        csv_file (str): 輸出的 CSV 路徑
+        journal_file (str): 進度日誌路徑
+        flush_every (int): 累積多少筆結果後寫入檔案
+    """
+
+    def __init__(self, csv_file=CSV_FILE, journal_file=JOURNAL_FILE, flush_every=FLUSH_EVERY):
+        self.csv_file = csv_file
+        self.journal_file = journal_file
+        self.flush_every = flush_every
+        self._rows = []
+        self._journal = []
+        self.written = 0
+
+    def processed_ids(self):
+        """讀取 CSV 與進度日誌中已處理的 ID"""
+        done = set()
+        if os.path.exists(self.csv_file):
+            df = pd.read_csv(self.csv_file, usecols=["food_id"], dtype=str)
+            done.update(df["food_id"])
+            print(f"已載入現有CSV文件，目前有 {len(df)} 筆資料")
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                done.update(line.split("\t", 1)[0] for line in f if line.strip())
+        return done
+
+    def add(self, food_id, food_data):
+        """加入一筆結果，food_data 為 None 表示 API 查無此 ID"""
         if food_data is None:
-            print(f"食物 ID {food_id} 處理失敗或已存在，已從 demand.txt 移除")
-            continue
-        save_to_csv(food_data, food_id)
-        fetched_foods.add(str(food_id))
-        print(f"成功獲取 {food_data['食物名稱']}，已從 demand.txt 移除")
+            self._journal.append((food_id, "missing"))
+        else:
+            self._rows.append({"food_id": food_id, **food_data})
+            self._journal.append((food_id, "fetched"))
+        if len(self._journal) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            new_file = not os.path.exists(self.csv_file) or os.path.getsize(self.csv_file) == 0
+            with open(self.csv_file, "a", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(self._rows)
+            self.written += len(self._rows)
+        if self._journal:
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                f.writelines(f"{food_id}\t{status}\n" for food_id, status in self._journal)
+        self._rows = []
+        self._journal = []
+
+
+def download(client, food_ids, writer, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS):
+    """
+    下載食物資料並寫入 CSV
+
+    已寫入 CSV 或記錄在進度日誌中的 ID 會跳過。取得資料或 API 查無的 ID 會記錄
+    在日誌中，重試後仍失敗的批次則不記錄，下次執行時再處理。
+
+    Args:
+        client (FdcClient): API 客戶端
+        food_ids (list[str]): 要查詢的食物 ID
+        writer (CheckpointWriter): 結果與進度的寫入器
+        batch_size (int): 每次請求的 ID 數
+        max_workers (int): 同時送出請求的執行緒數
+
+    Returns:
+        dict: 成功、查無與失敗的 ID 數
+    """
+    processed = writer.processed_ids()
+    print(f"已有 {len(processed)} 個食物ID記錄")
+
+    pending = list(dict.fromkeys(fid for fid in food_ids if fid and fid not in processed))
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    counts = {"fetched": 0, "missing": 0, "failed": 0}
+    t1 = time.time()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(client.get_foods, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    counts["failed"] += len(batch)
+                    print(f"批次 {batch[0]}..{batch[-1]} 處理失敗，下次執行時重試: {e}")
+                    continue
+
+                for fid in batch:
+                    writer.add(fid, results.get(fid))
+                counts["fetched"] += len(results)
+                counts["missing"] += len(batch) - len(results)
+
+                done = counts["fetched"] + counts["missing"] + counts["failed"]
+                elapsed = time.time() - t1
+                print(f"{time.ctime()} 已處理 {done}/{len(pending)} 筆（{done / max(elapsed, 1e-9):.1f} 筆/秒）")
+    finally:
+        writer.flush()
 
     print("所有食物數據處理完成！")
-    print(f"已從 demand.txt 移除已存在及成功獲取或失敗的 food_id，剩餘 {len(remaining_foods)} 筆待處理。")
+    print(f"成功 {counts['fetched']} 筆，查無 {counts['missing']} 筆，失敗 {counts['failed']} 筆"
+          f"（失敗的 ID 會在下次執行時重試）。")
+    return counts
 
-if __name__ == "__main__":
-    
-    main(time.time())
 
+def main():
+    parser = argparse.ArgumentParser(description="Download USDA FoodData Central nutrients for demand.txt")
+    parser.add_argument("--demand", default=DEMAND_FILE)
+    parser.add_argument("--output", default=CSV_FILE)
+    parser.add_argument("--journal", default=JOURNAL_FILE)
+    parser.add_argument("--flush-every", type=int, default=FLUSH_EVERY)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--api-key", default=API_KEY)
+    parser.add_argument("--rate-per-hour", type=float, default=RATE_PER_HOUR, help="0 disables rate limiting")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+    args = parser.parse_args()
+
+    with open(args.demand, "r", encoding="utf-8") as f:
+        food_ids = [line.strip() for line in f]
 
+    client = FdcClient(
+        api_key=args.api_key,
+        base_url=args.base_url,
+        rate_per_hour=args.rate_per_hour,
+        pool_size=args.workers,
+        max_retries=args.max_retries
+    )
+    writer = CheckpointWriter(args.output, args.journal, args.flush_every)
+    download(client, food_ids, writer, args.batch_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()